@@ -1,14 +1,67 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, abort
 from datetime import datetime, timedelta
 import work
 import frame
-import matplotlib.pyplot as plt
-import numpy as np
-import io
+import jobs
+import chart_cache
+import charts
+import checkpoint
+import metrics
+from concurrent.futures import ProcessPoolExecutor
+from loguru import logger
+import atexit
+import multiprocessing
+import os
 import base64
 
+CHART_TYPES = list(charts.RENDERERS)
+RENDER_PROCESSES = min(4, os.cpu_count() or 1)
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED') == '1'
+
 app = Flask(__name__)
-d = frame.Data()
+sampler = metrics.Sampler()
+d = None
+cache = None
+render_pool = None
+runner = None
+
+
+def setup():
+    # Процессы рендера (forkserver) заново импортируют этот модуль как
+    # __mp_main__, поэтому данные, кэш, пул и очередь парсинга создаются
+    # здесь и только в процессе сервера. forkserver, а не fork: процессы
+    # рендера не наследуют потоки парсера и Flask и соединения с базой
+    global d, cache, render_pool, runner
+    d = frame.Data()
+    cache = chart_cache.ChartCache()
+    render_pool = ProcessPoolExecutor(max_workers=RENDER_PROCESSES,
+                                      mp_context=multiprocessing.get_context('forkserver'))
+    atexit.register(render_pool.shutdown)
+    runner = jobs.JobManager(on_finish=on_crawl_finished)
+    # При debug=True модуль выполняется и в следящем процессе werkzeug, который
+    # запросы не обслуживает; парсинг продолжается только в дочернем
+    if __name__ != '__main__' or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        resume_crawls()
+
+
+def resume_crawls():
+    # Ключ чекпоинта - абсолютный интервал, а форма каждый раз считает его от
+    # текущего времени; прерванные рестартом запуски продолжаются здесь
+    pruned = checkpoint.prune()
+    if pruned:
+        logger.info(f'Удалены устаревшие чекпоинты: {pruned}')
+    for date_last, date_to, options in checkpoint.interrupted_runs():
+        logger.info(f'Продолжаю прерванный парсинг {date_last} - {date_to}')
+        runner.submit((date_last, date_to, options['incremental']),
+                      lambda date_last=date_last, date_to=date_to, options=options: work.Worker(date_last, date_to,
+                                                                                               **options))
+
+
+def on_crawl_finished(job):
+    d.update_count_of_data()
+    d.refresh()
+    d.save_snapshot()
+    precompute_charts()
 
 
 @app.route('/')
@@ -22,12 +75,18 @@ def parse_handler():
     data = request.form
     start_interval = int(data['start_interval'])
     end_interval = int(data['end_interval'])
+    incremental = data.get('incremental') == 'true'
     arg = get_date(start_interval, end_interval)
-    pr = work.Worker(*arg)
-    pr.run()
+    job = runner.submit((*arg, incremental), lambda: work.Worker(*arg, incremental=incremental))
+    return jsonify(job.to_dict()), 202
 
-    d.update_count_of_data()
-    return 'Parsing finished. Data count: {}'.format(d.data_count)
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = runner.get(job_id)
+    if job is None:
+        return jsonify({'error': 'job not found'}), 404
+    return jsonify(job.to_dict())
 
 
 @app.route('/get_data_count', methods=['GET'])
@@ -42,188 +101,105 @@ def get_date(left, timedelta_in_seconds):
     return list_time
 
 
-def show_chart_1():
-    df_pie = d.data.groupby('experience', as_index=False).id.count()
-    x = df_pie.experience
-    y = df_pie.id
-    fig = plt.figure(figsize=(10, 5))
-    ax = fig.add_subplot()
-    ax.pie(y, labels=x, autopct='%1.1f%%', textprops={'fontsize': 11})
-    return plt
-
-
-def show_chart_2():
-    data_b = d.salary_filter(d.data)
-    data_b = data_b.pivot_table(index='id', columns='schedule', values='salary_mean')
-    roles_list = ['Полный день', 'Удаленная работа', 'Гибкий график', 'Сменный график']
-    data_list, list_name = d.li_na(data_b, roles_list)
-
-    fig = plt.figure(figsize=(15, 10))
-    ax = fig.add_subplot()
-    bp = ax.boxplot(data_list, patch_artist=True)
-    colors = ['ForestGreen', 'IndianRed', 'goldenrod', 'CadetBlue']
-
-    valid_data_list = [data for data in data_list if len(data) > 1]
-    medians = [np.median(data) for data in valid_data_list]
-
-    for box, color, median, i in zip(bp['boxes'], colors, medians, range(1, len(valid_data_list) + 1)):
-        box.set_facecolor(color)
-        plt.setp(bp['medians'], linewidth=2)
-        plt.text(i, median, f'{median}', va='bottom', ha="center", bbox=dict(facecolor="w", alpha=0.2))
-
-    ax.ticklabel_format(style='plain', axis='y')
-    ax.set_ylim(0, 580000)
-    ax.set_title("Медианные предлагаемые зарплаты в ИТ-сфере в зависимости от графика работы")
-    ax.set_yticks(range(0, 580000, 50000))
-    ax.set_xticks(range(1, len(list_name) + 1))
-    ax.set_xticklabels(list_name)
-    ax.set_ylabel("Зарплата, руб.")
-    ax.grid()
-
-
-def show_chart_3():
-    data_s = d.salary_filter(d.data)
-    data_s = data_s.pivot_table(index='id', columns='experience', values='salary_mean')
-
-    roles_list = ['Нет опыта', 'От 1 года до 3 лет', 'От 3 до 6 лет', 'Более 6 лет']
-    data_list, list_name = d.li_na(data_s, roles_list)
-
-    fig = plt.figure(figsize=(15, 10))
-    ax = fig.add_subplot()
-    bp = ax.boxplot(data_list, patch_artist=True)
-    colors = ['ForestGreen', 'IndianRed', 'goldenrod', 'CadetBlue']
-
-    valid_data_list = [data for data in data_list if len(data) > 1]
-    medians = [np.median(data) for data in valid_data_list]
-
-    for box, color, median, i in zip(bp['boxes'], colors, medians, range(1, len(valid_data_list) + 1)):
-        box.set_facecolor(color)
-        plt.setp(bp['medians'], linewidth=2)
-        plt.text(i, median, f'{median}', va='bottom', ha="center", bbox=dict(facecolor="w", alpha=0.2))
-
-    ax.ticklabel_format(style='plain', axis='y')
-    ax.set_ylim(0, 580000)
-    ax.set_title("Медианные предлагаемые зарплаты в ИТ-сфере в зависимости от опыта")
-    ax.set_yticks(range(0, 580000, 50000))
-    ax.set_xticks(range(1, len(list_name) + 1))
-    ax.set_xticklabels(list_name)
-    ax.set_ylabel("Зарплата, руб.")
-    ax.grid()
-
-
-def show_chart_4():
-    data_area = d.salary_filter(d.data)
-    are_list = ['Москва', 'Санкт-Петербург', 'Новосибирск', 'Екатеринбург', 'Владивосток', 'Казань',
-                'Нижний Новгород', 'Ростов-на-Дону', 'Челябинск', 'Воронеж']
-    data_area = data_area[data_area.area_name.isin(are_list) == True]
-    data_area = data_area.pivot_table(index='id', columns='area_name', values='salary_mean')
-    data_list, list_name = d.li_na(data_area, are_list)
-
-    fig = plt.figure(figsize=(15, 10))
-    ax = fig.add_subplot()
-    bp = ax.boxplot(data_list, patch_artist=True)
-    colors = ['ForestGreen', 'IndianRed', 'goldenrod', 'CadetBlue', 'RoyalBlue', 'MediumTurquoise', 'SeaGreen',
-              'SkyBlue', 'DarkKhaki', 'Burlywood']
-
-    valid_data_list = [data for data in data_list if len(data) > 1]
-    medians = [np.median(data) for data in valid_data_list]
-
-    for box, color, median, i in zip(bp['boxes'], colors, medians, range(1, len(valid_data_list) + 1)):
-        box.set_facecolor(color)
-        plt.setp(bp['medians'], linewidth=2)
-        plt.text(i, median, f'{median}', va='bottom', ha="center", bbox=dict(facecolor="w", alpha=0.2))
-
-    ax.set_ylim(0, 400000)
-    ax.ticklabel_format(style='plain', axis='y')
-    ax.set_xticks(range(1, len(list_name) + 1))
-    ax.set_xticklabels(list_name, rotation=20)
-
-    ax.set_yticks(range(0, 400000, 50000))
-    ax.set_title("Медианные предлагаемые зарплаты по городам")
-    ax.set_ylabel("Зарплата")
-    ax.grid()
-
-
-def show_chart_5():
-    data_k = d.salary_filter(d.data)
-    data_k = data_k.pivot_table(index='id', columns='employment', values='salary_mean')
-    roles_list = ['Полная занятость', 'Частичная занятость', 'Стажировка', 'Проектная работа']
-    data_list, list_name = d.li_na(data_k, roles_list)
-
-    fig = plt.figure(figsize=(15, 10))
-    ax = fig.add_subplot()
-    bp = ax.boxplot(data_list, patch_artist=True)
-    colors = ['ForestGreen', 'IndianRed', 'goldenrod', 'CadetBlue']
-
-    valid_data_list = [data for data in data_list if len(data) > 1]
-    medians = [np.median(data) for data in valid_data_list]
-
-    for box, color, median, i in zip(bp['boxes'], colors, medians, range(1, len(valid_data_list) + 1)):
-        box.set_facecolor(color)
-        plt.setp(bp['medians'], linewidth=2)
-        plt.text(i, median, f'{median}', va='bottom', ha="center", bbox=dict(facecolor="w", alpha=0.2))
-
-    ax.ticklabel_format(style='plain', axis='y')
-    ax.set_ylim(0, 580000)
-    ax.set_title("Медианные предлагаемые зарплаты в ИТ-сфере в зависимости от опыта")
-    ax.set_yticks(range(0, 580000, 50000))
-    ax.set_xticks(range(1, len(list_name) + 1))
-    ax.set_xticklabels(list_name)
-    ax.set_ylabel("Зарплата, руб.")
-    ax.grid()
-
-
-def show_chart_6():
-    data = d.data
-    data_ex = data[(data.experience.isna() == False) & (data.schedule.isna() == False)]
-    data_ex = data_ex[data_ex.professional_roles_name == 'Программист, разработчик']
-
-    data_ex = data_ex.pivot_table(index='experience', columns='schedule', values='id', aggfunc='count', fill_value=0)
-    x = data_ex.index
-    y1 = data_ex['Полный день']
-    y2 = data_ex['Удаленная работа']
-
-    fig = plt.figure(figsize=(15, 10))
-    ax1 = fig.add_subplot(1, 2, 1)
-    ax2 = fig.add_subplot(1, 2, 2)
-    ax1.pie(y1, labels=x, autopct='%1.1f%%', textprops={'fontsize': 11})
-    ax2.pie(y2, labels=x, autopct='%1.1f%%', textprops={'fontsize': 11})
-    ax1.set_xlabel("Полный день", size=15)
-    ax2.set_xlabel("Удаленная работа", size=15)
-
-
-def build_graph(graph_type):
+def chart_data(graph_type):
+    # Данные графика в виде, пригодном и для рендера в пуле процессов,
+    # и для отдачи клиенту в JSON
     if graph_type == "chart_1":
-        show_chart_1()
-    elif graph_type == "chart_2":
-        show_chart_2()
-    elif graph_type == "chart_3":
-        show_chart_3()
-    elif graph_type == "chart_4":
-        show_chart_4()
-    elif graph_type == "chart_5":
-        show_chart_5()
-    elif graph_type == "chart_6":
-        show_chart_6()
-    else:
-        return None
-    buffer = io.BytesIO()
-    plt.savefig(buffer, format='png')
-    buffer.seek(0)
-    image_png = buffer.getvalue()
-    buffer.close()
-
+        df_pie = d.data.groupby('experience', as_index=False, observed=True).id.count()
+        return {'labels': df_pie.experience.astype(str).tolist(), 'values': df_pie.id.tolist()}
+    if graph_type in charts.SALARY_CHARTS:
+        column, list_name = charts.SALARY_CHARTS[graph_type]
+        return {'title': charts.TITLES[graph_type], 'labels': list_name,
+                'stats': d.salary_summary(column, list_name)}
+    if graph_type == "chart_6":
+        data = d.data
+        data_ex = data[(data.experience.isna() == False) & (data.schedule.isna() == False)]
+        data_ex = data_ex[data_ex.professional_roles_name == 'Программист, разработчик']
+        data_ex = data_ex.pivot_table(index='experience', columns='schedule', values='id', aggfunc='count',
+                                      fill_value=0, observed=True)
+        return {'labels': data_ex.index.astype(str).tolist(), 'full_day': data_ex['Полный день'].tolist(),
+                'remote': data_ex['Удаленная работа'].tolist()}
+    return None
+
+
+def build_graph(graph_type, payload):
+    with metrics.span('chart_render_seconds', chart=graph_type):
+        image_png = render_pool.submit(charts.render, graph_type, payload).result()
     graph_url = base64.b64encode(image_png).decode('utf-8')
     return 'data:image/png;base64,' + graph_url
 
 
+def cached_graph(graph_type, version, fmt='png'):
+    key = (graph_type, fmt, version)
+    graph = cache.get(key) if version is not None else None
+    metrics.inc('chart_cache_requests_total', chart=graph_type, result='miss' if graph is None else 'hit')
+    if graph is None:
+        with metrics.span('chart_query_seconds', chart=graph_type):
+            payload = chart_data(graph_type)
+        if payload is None:
+            return None
+        graph = payload if fmt == 'json' else build_graph(graph_type, payload)
+        if version is not None:
+            cache.put(key, graph)
+    return graph
+
+
+def precompute_charts():
+    version = d.data_version(fresh=True)
+    for graph_type in CHART_TYPES:
+        try:
+            cached_graph(graph_type, version)
+        except Exception:
+            logger.exception(f'Не удалось построить {graph_type}')
+
+
 @app.route('/plot', methods=['POST'])
 def plot():
     data = request.get_json()
     graph_type = data['graph']
-    graph = build_graph(graph_type)
+    graph = cached_graph(graph_type, d.data_version())
     return jsonify(graph)
 
 
+@app.route('/plot/<graph_type>', methods=['GET'])
+def plot_cached(graph_type):
+    if graph_type not in CHART_TYPES:
+        return jsonify({'error': 'unknown graph'}), 404
+    fmt = 'json' if request.args.get('format') == 'json' else 'png'
+    version = d.data_version()
+    etag = f'{graph_type}-{fmt}-{version[0]}-{version[1]}' if version is not None else None
+    if etag is not None and etag in request.if_none_match:
+        response = app.response_class(status=304)
+    else:
+        response = jsonify(cached_graph(graph_type, version, fmt))
+    if etag is not None:
+        response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_handler():
+    return app.response_class(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/profile/start', methods=['POST'])
+def profile_start():
+    if not PROFILING_ENABLED:
+        abort(404)
+    sampler.start()
+    return jsonify({'profiling': True})
+
+
+@app.route('/profile/stop', methods=['POST'])
+def profile_stop():
+    if not PROFILING_ENABLED:
+        abort(404)
+    return app.response_class(sampler.stop(), mimetype='text/plain')
+
+
+if __name__ != '__mp_main__':
+    setup()
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
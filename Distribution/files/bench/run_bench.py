@@ -0,0 +1,170 @@
+import argparse
+import glob
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import seed_db
+import synthetic
+from stub_api import StubServer
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+
+def bench_insert(args):
+    return seed_db.seed(args.rows, args.batch, args.per_hour)
+
+
+def bench_crawl(args, tmp_dir):
+    import work
+
+    spacing = 3600 / args.per_hour
+    start = seed_db.next_index()
+    total = start + int(args.hours * args.per_hour)
+    with StubServer(total=total, per_hour=args.per_hour, latency=args.latency, error_rate=args.error_rate,
+                    throttle_rate=args.throttle_rate) as stub:
+        work.URL = stub.url
+        work.Worker.limiter = work.RateLimiter(args.rate, args.rate)
+        date_last = synthetic.published_at(start, spacing)
+        # Для --replay прогон наполняет HTTP-кэш, который затем читается без сети
+        cache_path = os.path.join(tmp_dir, 'http.sqlite3') if args.replay else None
+        worker = work.Worker(date_last, date_last + timedelta(hours=args.hours), workers=args.workers,
+                             checkpoint_path=os.path.join(tmp_dir, 'checkpoints.sqlite3'), cache_path=cache_path)
+        started = time.perf_counter()
+        worker.run()
+        elapsed = time.perf_counter() - started
+    progress = worker.progress()
+    result = {'seconds': elapsed, 'requests': progress['requests_sent'], 'docs_written': progress['docs_written'],
+              'plan_requests': progress['plan_requests'], 'windows': progress['windows_planned'],
+              'requests_per_second': progress['requests_sent'] / elapsed,
+              'docs_per_second': progress['docs_written'] / elapsed}
+    if args.replay:
+        result['replay'] = bench_replay(args, tmp_dir, date_last, cache_path)
+    return result
+
+
+def bench_replay(args, tmp_dir, date_last, cache_path):
+    # Тот же интервал в режиме offline: все ответы берутся из кэша прогона
+    # выше, заглушка уже остановлена
+    import work
+
+    worker = work.Worker(date_last, date_last + timedelta(hours=args.hours), workers=args.workers, upsert=True,
+                         checkpoint_path=os.path.join(tmp_dir, 'replay.sqlite3'), cache_path=cache_path,
+                         offline=True)
+    started = time.perf_counter()
+    worker.run()
+    elapsed = time.perf_counter() - started
+    progress = worker.progress()
+    return {'seconds': elapsed, 'cache_hits': progress['cache_hits'], 'pages': progress['pages_fetched'],
+            'cache_hits_per_second': progress['cache_hits'] / elapsed, 'losses': sum(worker.lost.values())}
+
+
+def bench_dataframe(args, tmp_dir):
+    import frame
+
+    snapshot_path = os.path.join(tmp_dir, 'vacancies.parquet')
+    data = frame.Data(snapshot_path=snapshot_path)
+    started = time.perf_counter()
+    df = data.to_dataframe()
+    result = {'rows': len(df), 'load_seconds': time.perf_counter() - started,
+              'memory_mb': df.memory_usage(deep=True).sum() / 1024 ** 2}
+    data.refresh()
+    # Снимок пишется только при наборе не меньше MIN_ROWS строк
+    if frame.pa is not None and data.frame is not None:
+        data.save_snapshot()
+        started = time.perf_counter()
+        cold = frame.Data(snapshot_path=snapshot_path)
+        result['snapshot_load_seconds'] = time.perf_counter() - started
+        result['snapshot_memory_mb'] = cold.frame.memory_usage(deep=True).sum() / 1024 ** 2
+    return result
+
+
+def bench_charts(args):
+    import app
+    import charts
+
+    result = {}
+    for graph_type in app.CHART_TYPES:
+        query, render = [], []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            payload = app.chart_data(graph_type)
+            query.append(time.perf_counter() - started)
+            started = time.perf_counter()
+            charts.render(graph_type, payload)
+            render.append(time.perf_counter() - started)
+        result[graph_type] = {'query_ms': statistics.median(query) * 1000,
+                              'render_ms': statistics.median(render) * 1000}
+    return result
+
+
+def flatten(results, prefix=''):
+    metrics = {}
+    for key, value in results.items():
+        name = f'{prefix}{key}'
+        if isinstance(value, dict):
+            metrics.update(flatten(value, f'{name}.'))
+        elif isinstance(value, (int, float)):
+            metrics[name] = value
+    return metrics
+
+
+def compare(results):
+    # Сравнение с последним сохранённым прогоном
+    previous = sorted(glob.glob(os.path.join(RESULTS_DIR, '*.json')))
+    if not previous:
+        return
+    with open(previous[-1]) as f:
+        before = flatten(json.load(f)['results'])
+    print(f'Сравнение с {os.path.basename(previous[-1])}:')
+    for name, value in flatten(results).items():
+        if name in before and before[name]:
+            change = (value - before[name]) / before[name] * 100
+            print(f'  {name}: {before[name]:.3f} -> {value:.3f} ({change:+.1f}%)')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарки парсера и дашборда')
+    parser.add_argument('--only', nargs='+', choices=['insert', 'crawl', 'dataframe', 'charts'],
+                        default=['insert', 'crawl', 'dataframe', 'charts'])
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--batch', type=int, default=seed_db.DEFAULT_BATCH)
+    parser.add_argument('--hours', type=float, default=4)
+    parser.add_argument('--per-hour', type=int, default=500)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--error-rate', type=float, default=0.01)
+    parser.add_argument('--throttle-rate', type=float, default=0.005)
+    parser.add_argument('--rate', type=float, default=100)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--replay', action='store_true', help='повторить парсинг offline из HTTP-кэша')
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if 'insert' in args.only:
+            results['insert'] = bench_insert(args)
+        if 'crawl' in args.only:
+            results['crawl'] = bench_crawl(args, tmp_dir)
+        if 'dataframe' in args.only:
+            results['dataframe'] = bench_dataframe(args, tmp_dir)
+        if 'charts' in args.only:
+            results['charts'] = bench_charts(args)
+
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+    compare(results)
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, datetime.now().strftime('%Y%m%d-%H%M%S') + '.json')
+    with open(path, 'w') as f:
+        json.dump({'args': vars(args), 'results': results}, f, indent=2, ensure_ascii=False)
+    print(f'Результаты сохранены в {path}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db
+import synthetic
+
+DEFAULT_BATCH = 1000
+
+
+def next_index():
+    # Новые документы получают номера после уже загруженных, чтобы повторный
+    # запуск добавлял строки, а не упирался в ON CONFLICT
+    conn = db.connect()
+    try:
+        with conn.cursor() as cur:
+            db.ensure_schema(cur)
+            cur.execute('SELECT COALESCE(MAX(vacancies_id), %s) FROM vacancies WHERE vacancies_id >= %s',
+                        (synthetic.START_ID - 1, synthetic.START_ID))
+            last = cur.fetchone()[0]
+        conn.commit()
+    finally:
+        conn.close()
+    return synthetic.vacancy_index(last) + 1
+
+
+def seed(count, batch_size=DEFAULT_BATCH, per_hour=500, description_size=3000):
+    spacing = 3600 / per_hour
+    start = next_index()
+    writer = db.Writer()
+    written = 0
+    elapsed = 0
+    try:
+        for offset in range(start, start + count, batch_size):
+            batch = [(synthetic.vacancy_id(i), synthetic.vacancy_bytes(i, spacing, description_size))
+                     for i in range(offset, min(offset + batch_size, start + count))]
+            # Время генерации документов в замер не входит
+            started = time.perf_counter()
+            written += writer.write(batch)
+            elapsed += time.perf_counter() - started
+    finally:
+        writer.close()
+    return {'rows': written, 'seconds': elapsed, 'rows_per_second': written / elapsed if elapsed else 0}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Наполнение базы синтетическими вакансиями')
+    parser.add_argument('count', type=int)
+    parser.add_argument('--batch', type=int, default=DEFAULT_BATCH)
+    args = parser.parse_args()
+    print(seed(args.count, args.batch))
@@ -0,0 +1,96 @@
+import argparse
+import math
+import random
+import threading
+import time
+from datetime import datetime
+from flask import Flask, request, jsonify, Response
+from werkzeug.serving import make_server
+
+import synthetic
+
+# Локальная заглушка /vacancies: поиск по интервалу с ограничением глубины
+# выдачи 2000 как у api.hh.ru, детальные документы реалистичного размера,
+# задержка и случайные 5xx/429
+
+MAX_DEPTH = 2000
+
+
+def create_app(total=100000, per_hour=500, latency=0.05, error_rate=0.01, throttle_rate=0.005,
+               description_size=3000):
+    app = Flask(__name__)
+    spacing = 3600 / per_hour
+    rng = random.Random()
+
+    def index_of(date):
+        seconds = (datetime.fromisoformat(date) - synthetic.BASE_DATE).total_seconds()
+        return min(max(0, math.ceil(seconds / spacing)), total)
+
+    @app.before_request
+    def simulate_network():
+        time.sleep(rng.uniform(latency * 0.5, latency * 1.5))
+        roll = rng.random()
+        if roll < error_rate:
+            return Response('stub error', status=503)
+        if roll < error_rate + throttle_rate:
+            return Response('too many requests', status=429, headers={'Retry-After': '1'})
+
+    @app.route('/vacancies')
+    def search():
+        per_page = int(request.args.get('per_page', 20))
+        page = int(request.args.get('page', 0))
+        if (page + 1) * per_page > MAX_DEPTH:
+            return jsonify({'errors': [{'type': 'bad_argument'}]}), 400
+        left = index_of(request.args['date_from'])
+        right = index_of(request.args['date_to'])
+        found = max(0, right - left)
+        newest = right - 1 - page * per_page
+        items = [synthetic.search_item(i, spacing) for i in range(newest, max(left - 1, newest - per_page), -1)]
+        pages = min(math.ceil(found / per_page), MAX_DEPTH // per_page)
+        return jsonify({'found': found, 'pages': pages, 'page': page, 'per_page': per_page, 'items': items})
+
+    @app.route('/vacancies/<id>')
+    def vacancy(id):
+        i = synthetic.vacancy_index(id)
+        if not 0 <= i < total:
+            return jsonify({'errors': [{'type': 'not_found'}]}), 404
+        etag = f'"{id}"'
+        if etag in request.headers.get('If-None-Match', ''):
+            return Response(status=304, headers={'ETag': etag})
+        body = synthetic.vacancy_bytes(i, spacing, description_size)
+        return Response(body, mimetype='application/json', headers={'ETag': etag})
+
+    app.config['spacing'] = spacing
+    return app
+
+
+class StubServer:
+    def __init__(self, host='127.0.0.1', port=0, **options):
+        self.app = create_app(**options)
+        self.server = make_server(host, port, self.app, threaded=True)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f'http://{self.server.host}:{self.server.port}/vacancies'
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.thread.join()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Заглушка API вакансий')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--total', type=int, default=100000)
+    parser.add_argument('--per-hour', type=int, default=500)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--error-rate', type=float, default=0.01)
+    parser.add_argument('--throttle-rate', type=float, default=0.005)
+    args = parser.parse_args()
+    create_app(args.total, args.per_hour, args.latency, args.error_rate, args.throttle_rate).run(port=args.port,
+                                                                                              threaded=True)
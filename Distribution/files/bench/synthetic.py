@@ -0,0 +1,88 @@
+import json
+import random
+from datetime import datetime, timedelta
+
+# Детерминированные синтетические вакансии: документ с номером i всегда
+# одинаков, поэтому заглушка API и наполнение базы дают воспроизводимые данные
+
+BASE_DATE = datetime(2024, 1, 1)
+START_ID = 90000000
+
+AREAS = ['Москва', 'Санкт-Петербург', 'Новосибирск', 'Екатеринбург', 'Владивосток', 'Казань',
+         'Нижний Новгород', 'Ростов-на-Дону', 'Челябинск', 'Воронеж', 'Самара', 'Пермь', 'Омск', 'Томск']
+SCHEDULES = ['Полный день', 'Удаленная работа', 'Гибкий график', 'Сменный график']
+EXPERIENCES = ['Нет опыта', 'От 1 года до 3 лет', 'От 3 до 6 лет', 'Более 6 лет']
+EMPLOYMENTS = ['Полная занятость', 'Частичная занятость', 'Стажировка', 'Проектная работа']
+ROLES = ['Программист, разработчик', 'Тестировщик', 'Аналитик', 'DevOps-инженер', 'Системный администратор',
+         'Менеджер продукта', 'Дизайнер, художник']
+SKILLS = ['Python', 'SQL', 'PostgreSQL', 'Git', 'Linux', 'Docker', 'Java', 'JavaScript', 'Go', 'Kubernetes',
+          'pandas', 'Flask', 'Django', 'React', 'C++', 'REST API']
+STATIONS = ['Курская', 'Таганская', 'Арбатская', 'Пушкинская', 'Маяковская', 'Белорусская', 'Киевская']
+WORDS = ['разработка', 'сервис', 'команда', 'проект', 'опыт', 'задачи', 'продукт', 'данные', 'требования',
+         'условия', 'компания', 'код', 'архитектура', 'поддержка', 'тестирование', 'инфраструктура']
+
+
+def vacancy_id(i):
+    return START_ID + i
+
+
+def vacancy_index(id):
+    return int(id) - START_ID
+
+
+def published_at(i, spacing):
+    return BASE_DATE + timedelta(seconds=i * spacing)
+
+
+def format_date(date):
+    return date.strftime('%Y-%m-%dT%H:%M:%S') + '+0300'
+
+
+def description(rng, size):
+    parts = []
+    length = 0
+    while length < size:
+        sentence = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(6, 14)))
+        parts.append(f'<p>{sentence.capitalize()}.</p>')
+        length += len(parts[-1].encode())
+    return ''.join(parts)
+
+
+def vacancy(i, spacing, description_size=3000):
+    rng = random.Random(i)
+    salary_from = rng.randrange(30000, 300000, 5000)
+    salary = None
+    if rng.random() < 0.6:
+        salary = {'from': salary_from, 'to': salary_from + rng.randrange(0, 150000, 5000),
+                  'currency': 'RUR' if rng.random() < 0.95 else 'USD', 'gross': rng.random() < 0.4}
+    metro = [{'station_name': name} for name in rng.sample(STATIONS, rng.randint(0, 2))]
+    return {
+        'id': str(vacancy_id(i)),
+        'name': f'{rng.choice(ROLES)} #{i}',
+        'area': {'id': str(rng.randint(1, 100)), 'name': rng.choice(AREAS)},
+        'salary': salary,
+        'type': {'id': 'open', 'name': 'Открытая'},
+        'address': {'city': None, 'metro_stations': metro},
+        'experience': {'name': rng.choice(EXPERIENCES)},
+        'schedule': {'name': rng.choice(SCHEDULES)},
+        'employment': {'name': rng.choice(EMPLOYMENTS)},
+        'professional_roles': [{'id': str(rng.randint(1, 170)), 'name': rng.choice(ROLES)}],
+        'key_skills': [{'name': name} for name in rng.sample(SKILLS, rng.randint(0, 8))],
+        'employer': {'id': str(rng.randint(1, 50000)), 'name': f'Компания {rng.randint(1, 5000)}',
+                     'trusted': True, 'accredited_it_employer': rng.random() < 0.3},
+        'languages': [],
+        'description': description(rng, description_size),
+        'premium': False,
+        'archived': False,
+        'has_test': False,
+        'created_at': format_date(published_at(i, spacing)),
+        'published_at': format_date(published_at(i, spacing)),
+    }
+
+
+def vacancy_bytes(i, spacing, description_size=3000):
+    return json.dumps(vacancy(i, spacing, description_size), ensure_ascii=False).encode()
+
+
+def search_item(i, spacing):
+    return {'id': str(vacancy_id(i)), 'published_at': format_date(published_at(i, spacing))}
@@ -0,0 +1,29 @@
+import threading
+from collections import OrderedDict
+
+MAX_CACHED_CHARTS = 32
+
+
+class ChartCache:
+    # LRU-кэш готовых графиков. Ключ включает версию данных, поэтому после
+    # изменения таблицы старые записи просто перестают запрашиваться и
+    # вытесняются новыми
+    def __init__(self, max_size=MAX_CACHED_CHARTS):
+        self.max_size = max_size
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.items.get(key)
+            if value is None:
+                return None
+            self.items.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            while len(self.items) > self.max_size:
+                self.items.popitem(last=False)
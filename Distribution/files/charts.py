@@ -0,0 +1,155 @@
+import io
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+# Рисование через объектный API matplotlib без глобального состояния pyplot:
+# функции получают только готовые данные графика и могут выполняться
+# параллельно в потоках или в пуле процессов
+
+SCHEDULES = ['Полный день', 'Удаленная работа', 'Гибкий график', 'Сменный график']
+EXPERIENCES = ['Нет опыта', 'От 1 года до 3 лет', 'От 3 до 6 лет', 'Более 6 лет']
+AREAS = ['Москва', 'Санкт-Петербург', 'Новосибирск', 'Екатеринбург', 'Владивосток', 'Казань',
+         'Нижний Новгород', 'Ростов-на-Дону', 'Челябинск', 'Воронеж']
+EMPLOYMENTS = ['Полная занятость', 'Частичная занятость', 'Стажировка', 'Проектная работа']
+
+SALARY_CHARTS = {
+    'chart_2': ('schedule', SCHEDULES),
+    'chart_3': ('experience', EXPERIENCES),
+    'chart_4': ('area_name', AREAS),
+    'chart_5': ('employment', EMPLOYMENTS),
+}
+
+TITLES = {
+    'chart_2': "Медианные предлагаемые зарплаты в ИТ-сфере в зависимости от графика работы",
+    'chart_3': "Медианные предлагаемые зарплаты в ИТ-сфере в зависимости от опыта",
+    'chart_4': "Медианные предлагаемые зарплаты по городам",
+    'chart_5': "Медианные предлагаемые зарплаты в ИТ-сфере в зависимости от опыта",
+}
+
+
+def draw_salary_boxes(ax, stats, colors):
+    # stats - сводки из Data.salary_summary; пустые категории пропускаются,
+    # но сохраняют своё место на оси
+    positions = [i + 1 for i, item in enumerate(stats) if item is not None]
+    if not positions:
+        return
+    bp = ax.bxp([stats[i - 1] for i in positions], positions=positions, patch_artist=True, showfliers=False)
+    for box, i in zip(bp['boxes'], positions):
+        box.set_facecolor(colors[i - 1])
+        median = stats[i - 1]['med']
+        ax.text(i, median, f'{median}', va='bottom', ha="center", bbox=dict(facecolor="w", alpha=0.2))
+    for line in bp['medians']:
+        line.set_linewidth(2)
+
+
+def show_chart_1(payload):
+    fig = Figure(figsize=(10, 5))
+    ax = fig.add_subplot()
+    ax.pie(payload['values'], labels=payload['labels'], autopct='%1.1f%%', textprops={'fontsize': 11})
+    return fig
+
+
+def show_chart_2(payload):
+    list_name = SCHEDULES
+    fig = Figure(figsize=(15, 10))
+    ax = fig.add_subplot()
+    colors = ['ForestGreen', 'IndianRed', 'goldenrod', 'CadetBlue']
+    draw_salary_boxes(ax, payload['stats'], colors)
+
+    ax.ticklabel_format(style='plain', axis='y')
+    ax.set_ylim(0, 580000)
+    ax.set_title(TITLES['chart_2'])
+    ax.set_yticks(range(0, 580000, 50000))
+    ax.set_xticks(range(1, len(list_name) + 1))
+    ax.set_xticklabels(list_name)
+    ax.set_ylabel("Зарплата, руб.")
+    ax.grid()
+    return fig
+
+
+def show_chart_3(payload):
+    list_name = EXPERIENCES
+    fig = Figure(figsize=(15, 10))
+    ax = fig.add_subplot()
+    colors = ['ForestGreen', 'IndianRed', 'goldenrod', 'CadetBlue']
+    draw_salary_boxes(ax, payload['stats'], colors)
+
+    ax.ticklabel_format(style='plain', axis='y')
+    ax.set_ylim(0, 580000)
+    ax.set_title(TITLES['chart_3'])
+    ax.set_yticks(range(0, 580000, 50000))
+    ax.set_xticks(range(1, len(list_name) + 1))
+    ax.set_xticklabels(list_name)
+    ax.set_ylabel("Зарплата, руб.")
+    ax.grid()
+    return fig
+
+
+def show_chart_4(payload):
+    list_name = AREAS
+    fig = Figure(figsize=(15, 10))
+    ax = fig.add_subplot()
+    colors = ['ForestGreen', 'IndianRed', 'goldenrod', 'CadetBlue', 'RoyalBlue', 'MediumTurquoise', 'SeaGreen',
+              'SkyBlue', 'DarkKhaki', 'Burlywood']
+    draw_salary_boxes(ax, payload['stats'], colors)
+
+    ax.set_ylim(0, 400000)
+    ax.ticklabel_format(style='plain', axis='y')
+    ax.set_xticks(range(1, len(list_name) + 1))
+    ax.set_xticklabels(list_name, rotation=20)
+
+    ax.set_yticks(range(0, 400000, 50000))
+    ax.set_title(TITLES['chart_4'])
+    ax.set_ylabel("Зарплата")
+    ax.grid()
+    return fig
+
+
+def show_chart_5(payload):
+    list_name = EMPLOYMENTS
+    fig = Figure(figsize=(15, 10))
+    ax = fig.add_subplot()
+    colors = ['ForestGreen', 'IndianRed', 'goldenrod', 'CadetBlue']
+    draw_salary_boxes(ax, payload['stats'], colors)
+
+    ax.ticklabel_format(style='plain', axis='y')
+    ax.set_ylim(0, 580000)
+    ax.set_title(TITLES['chart_5'])
+    ax.set_yticks(range(0, 580000, 50000))
+    ax.set_xticks(range(1, len(list_name) + 1))
+    ax.set_xticklabels(list_name)
+    ax.set_ylabel("Зарплата, руб.")
+    ax.grid()
+    return fig
+
+
+def show_chart_6(payload):
+    fig = Figure(figsize=(15, 10))
+    ax1 = fig.add_subplot(1, 2, 1)
+    ax2 = fig.add_subplot(1, 2, 2)
+    ax1.pie(payload['full_day'], labels=payload['labels'], autopct='%1.1f%%', textprops={'fontsize': 11})
+    ax2.pie(payload['remote'], labels=payload['labels'], autopct='%1.1f%%', textprops={'fontsize': 11})
+    ax1.set_xlabel("Полный день", size=15)
+    ax2.set_xlabel("Удаленная работа", size=15)
+    return fig
+
+
+RENDERERS = {
+    'chart_1': show_chart_1,
+    'chart_2': show_chart_2,
+    'chart_3': show_chart_3,
+    'chart_4': show_chart_4,
+    'chart_5': show_chart_5,
+    'chart_6': show_chart_6,
+}
+
+
+def render(graph_type, payload):
+    fig = RENDERERS[graph_type](payload)
+    buffer = io.BytesIO()
+    try:
+        FigureCanvasAgg(fig).print_png(buffer)
+        return buffer.getvalue()
+    finally:
+        buffer.close()
+        fig.clear()
@@ -0,0 +1,185 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+CHECKPOINT_PATH = 'checkpoints.sqlite3'
+DEFAULT_COMMIT_INTERVAL = 5
+# Незавершённый запуск продолжается при старте не больше MAX_RESUME_ATTEMPTS
+# раз, а его состояние хранится не дольше MAX_AGE секунд
+MAX_RESUME_ATTEMPTS = 3
+MAX_AGE = 7 * 24 * 60 * 60
+TABLES = ('runs', 'planner', 'windows', 'gaps', 'ids')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    key TEXT PRIMARY KEY,
+    date_last TEXT NOT NULL,
+    date_to TEXT NOT NULL,
+    options TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 1,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS planner (
+    key TEXT PRIMARY KEY,
+    date_right REAL NOT NULL,
+    step REAL NOT NULL,
+    done INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS windows (
+    key TEXT NOT NULL,
+    date_from TEXT NOT NULL,
+    date_to TEXT NOT NULL,
+    pages INTEGER NOT NULL,
+    next_page INTEGER NOT NULL DEFAULT 1,
+    PRIMARY KEY (key, date_from)
+);
+CREATE TABLE IF NOT EXISTS gaps (
+    key TEXT NOT NULL,
+    date_left REAL NOT NULL,
+    date_right REAL NOT NULL,
+    PRIMARY KEY (key, date_left)
+);
+CREATE TABLE IF NOT EXISTS ids (
+    key TEXT NOT NULL,
+    id TEXT NOT NULL,
+    fetched INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (key, id)
+);
+'''
+
+
+class Checkpoint:
+    # Состояние одного запуска Worker в локальной SQLite: позиция планировщика,
+    # окна с последней скачанной страницей и увиденные/записанные ids.
+    # Фиксируется не чаще раза в DEFAULT_COMMIT_INTERVAL секунд, поэтому после
+    # падения повторяется не больше нескольких секунд работы
+    def __init__(self, key, path=CHECKPOINT_PATH):
+        self.key = key
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript(SCHEMA)
+        self.committed = time.monotonic()
+
+    def maybe_commit(self):
+        if time.monotonic() - self.committed >= DEFAULT_COMMIT_INTERVAL:
+            self.conn.commit()
+            self.committed = time.monotonic()
+
+    def register(self, date_last, date_to, options):
+        # Параметры запуска, чтобы продолжить его после перезапуска сервиса
+        with self.lock:
+            self.conn.execute('INSERT INTO runs (key, date_last, date_to, options, updated_at) VALUES (?, ?, ?, ?, ?) '
+                              'ON CONFLICT (key) DO UPDATE SET attempts = attempts + 1, updated_at = excluded.updated_at',
+                              (self.key, date_last.isoformat(), date_to.isoformat(), json.dumps(options), time.time()))
+            self.conn.commit()
+
+    def planner_position(self):
+        with self.lock:
+            row = self.conn.execute('SELECT date_right, step, done FROM planner WHERE key = ?',
+                                    (self.key,)).fetchone()
+        return (row[0], row[1], bool(row[2])) if row else None
+
+    def save_planner(self, date_right, step, done=False):
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO planner (key, date_right, step, done) VALUES (?, ?, ?, ?)',
+                              (self.key, date_right, step, int(done)))
+            self.maybe_commit()
+
+    def add_window(self, date_from, date_to, pages):
+        with self.lock:
+            self.conn.execute('INSERT OR IGNORE INTO windows (key, date_from, date_to, pages) VALUES (?, ?, ?, ?)',
+                              (self.key, date_from.isoformat(), date_to.isoformat(), pages))
+            self.maybe_commit()
+
+    def page_done(self, date_from, page):
+        with self.lock:
+            self.conn.execute('UPDATE windows SET next_page = ? WHERE key = ? AND date_from = ?',
+                              (page + 1, self.key, date_from.isoformat()))
+            self.maybe_commit()
+
+    def pending_windows(self):
+        with self.lock:
+            rows = self.conn.execute('SELECT date_from, date_to, pages, next_page FROM windows '
+                                     'WHERE key = ? AND next_page < pages', (self.key,)).fetchall()
+        return [[datetime.fromisoformat(row[0]), datetime.fromisoformat(row[1]), row[2], row[3]] for row in rows]
+
+    def add_gap(self, date_left, date_right):
+        # Интервал, который планировщик не смог прощупать; планируется заново
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO gaps (key, date_left, date_right) VALUES (?, ?, ?)',
+                              (self.key, date_left, date_right))
+            self.maybe_commit()
+
+    def remove_gap(self, date_left):
+        with self.lock:
+            self.conn.execute('DELETE FROM gaps WHERE key = ? AND date_left = ?', (self.key, date_left))
+            self.maybe_commit()
+
+    def gaps(self):
+        with self.lock:
+            return self.conn.execute('SELECT date_left, date_right FROM gaps WHERE key = ? ORDER BY date_left DESC',
+                                     (self.key,)).fetchall()
+
+    def add_ids(self, ids, fetched=False):
+        with self.lock:
+            self.conn.executemany('INSERT OR IGNORE INTO ids (key, id, fetched) VALUES (?, ?, ?)',
+                                  [(self.key, id, int(fetched)) for id in ids])
+            self.maybe_commit()
+
+    def mark_fetched(self, ids):
+        with self.lock:
+            self.conn.executemany('UPDATE ids SET fetched = 1 WHERE key = ? AND id = ?',
+                                  [(self.key, id) for id in ids])
+            self.maybe_commit()
+
+    def seen_ids(self):
+        with self.lock:
+            return self.conn.execute('SELECT id, fetched FROM ids WHERE key = ?', (self.key,)).fetchall()
+
+    def clear(self):
+        with self.lock:
+            for table in TABLES:
+                self.conn.execute(f'DELETE FROM {table} WHERE key = ?', (self.key,))
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
+
+
+def interrupted_runs(path=CHECKPOINT_PATH, max_attempts=MAX_RESUME_ATTEMPTS):
+    # Запуски, не дошедшие до clear(): прерванные или завершённые с потерями
+    if not os.path.exists(path):
+        return []
+    conn = sqlite3.connect(path)
+    try:
+        conn.executescript(SCHEMA)
+        rows = conn.execute('SELECT date_last, date_to, options FROM runs WHERE attempts < ? ORDER BY updated_at',
+                            (max_attempts,)).fetchall()
+    finally:
+        conn.close()
+    return [(datetime.fromisoformat(row[0]), datetime.fromisoformat(row[1]), json.loads(row[2])) for row in rows]
+
+
+def prune(path=CHECKPOINT_PATH, max_age=MAX_AGE):
+    # Удаляет состояние запусков старше max_age и ключи без записи в runs
+    # (от прежних версий); вызывать, пока ни один Worker не работает
+    if not os.path.exists(path):
+        return 0
+    conn = sqlite3.connect(path)
+    try:
+        conn.executescript(SCHEMA)
+        stale = [row[0] for row in conn.execute('SELECT key FROM runs WHERE updated_at < ?',
+                                                 (time.time() - max_age,))]
+        for table in TABLES:
+            conn.executemany(f'DELETE FROM {table} WHERE key = ?', [(key,) for key in stale])
+            if table != 'runs':
+                conn.execute(f'DELETE FROM {table} WHERE key NOT IN (SELECT key FROM runs)')
+        conn.commit()
+    finally:
+        conn.close()
+    return len(stale)
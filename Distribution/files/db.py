@@ -0,0 +1,284 @@
+import io
+import os
+import threading
+import psycopg2
+from loguru import logger
+import metrics
+
+DB_PARAMS = {'database': os.environ.get('DB_NAME', 'mydatabase'),
+             'user': os.environ.get('DB_USER', 'myuser'),
+             'host': os.environ.get('DB_HOST', 'postgres'),
+             'port': int(os.environ.get('DB_PORT', 5432)),
+             'password': os.environ.get('DB_PASSWORD', 'mypassword')}
+DB_URL = 'postgresql://{user}:{password}@{host}:{port}/{database}'.format(**DB_PARAMS)
+
+CREATE_TABLE_QUERY = '''
+CREATE TABLE IF NOT EXISTS vacancies (
+    vacancies_id INTEGER PRIMARY KEY,
+    data_jsonb JSONB
+);
+'''
+
+# ALTER TABLE берёт ACCESS EXCLUSIVE на vacancies даже с IF NOT EXISTS и
+# встаёт в очередь за чтением дашборда, поэтому столбец проверяется заранее
+ADD_ROW_VERSION_QUERY = '''
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM information_schema.columns
+                   WHERE table_schema = current_schema() AND table_name = 'vacancies'
+                     AND column_name = 'row_version') THEN
+        ALTER TABLE vacancies ADD COLUMN row_version BIGSERIAL;
+        CREATE INDEX IF NOT EXISTS vacancies_row_version_idx ON vacancies (row_version);
+    END IF;
+END $$;
+'''
+
+# Пакет сначала загружается COPY во временную таблицу: документы идут в
+# буфер как есть, в байтах, без разбора и повторной сериализации в Python
+CREATE_STAGING_QUERY = '''
+CREATE TEMP TABLE IF NOT EXISTS vacancies_staging (
+    vacancies_id INTEGER,
+    data_jsonb JSONB
+) ON COMMIT DELETE ROWS;
+'''
+
+COPY_QUERY = 'COPY vacancies_staging (vacancies_id, data_jsonb) FROM STDIN WITH (FORMAT csv)'
+
+INSERT_QUERY = '''
+INSERT INTO vacancies (vacancies_id, data_jsonb) SELECT vacancies_id, data_jsonb FROM vacancies_staging
+ON CONFLICT (vacancies_id) DO NOTHING
+RETURNING vacancies_id
+'''
+
+UPSERT_QUERY = '''
+INSERT INTO vacancies (vacancies_id, data_jsonb) SELECT vacancies_id, data_jsonb FROM vacancies_staging
+ON CONFLICT (vacancies_id) DO UPDATE SET data_jsonb = EXCLUDED.data_jsonb,
+    row_version = nextval(pg_get_serial_sequence('vacancies', 'row_version'))
+WHERE vacancies.data_jsonb IS DISTINCT FROM EXCLUDED.data_jsonb
+RETURNING vacancies_id
+'''
+
+# Типизированная проекция полей, по которым строятся графики, и отдельные
+# таблицы навыков и станций метро. Заполняется Writer в той же транзакции,
+# что и vacancies
+CREATE_PROJECTION_QUERY = '''
+CREATE TABLE IF NOT EXISTS vacancy_facts (
+    vacancies_id INTEGER PRIMARY KEY REFERENCES vacancies ON DELETE CASCADE,
+    salary_from INTEGER,
+    salary_to INTEGER,
+    salary_currency TEXT,
+    salary_gross BOOLEAN,
+    experience TEXT,
+    schedule TEXT,
+    employment TEXT,
+    area_name TEXT,
+    professional_roles_name TEXT,
+    published_at TIMESTAMPTZ
+);
+CREATE INDEX IF NOT EXISTS vacancy_facts_salary_idx ON vacancy_facts (salary_currency, salary_from, salary_to);
+CREATE INDEX IF NOT EXISTS vacancy_facts_experience_idx ON vacancy_facts (experience);
+CREATE INDEX IF NOT EXISTS vacancy_facts_schedule_idx ON vacancy_facts (schedule);
+CREATE INDEX IF NOT EXISTS vacancy_facts_employment_idx ON vacancy_facts (employment);
+CREATE INDEX IF NOT EXISTS vacancy_facts_area_name_idx ON vacancy_facts (area_name);
+CREATE INDEX IF NOT EXISTS vacancy_facts_roles_idx ON vacancy_facts (professional_roles_name);
+CREATE INDEX IF NOT EXISTS vacancy_facts_published_at_idx ON vacancy_facts (published_at);
+CREATE TABLE IF NOT EXISTS vacancy_skills (
+    vacancies_id INTEGER REFERENCES vacancies ON DELETE CASCADE,
+    name TEXT,
+    PRIMARY KEY (vacancies_id, name)
+);
+CREATE INDEX IF NOT EXISTS vacancy_skills_name_idx ON vacancy_skills (name);
+CREATE TABLE IF NOT EXISTS vacancy_metro (
+    vacancies_id INTEGER REFERENCES vacancies ON DELETE CASCADE,
+    station_name TEXT,
+    PRIMARY KEY (vacancies_id, station_name)
+);
+CREATE INDEX IF NOT EXISTS vacancy_metro_station_idx ON vacancy_metro (station_name);
+'''
+
+# ids = NULL пересчитывает проекцию для всей таблицы
+PROJECT_QUERY = '''
+INSERT INTO vacancy_facts (vacancies_id, salary_from, salary_to, salary_currency, salary_gross, experience,
+                           schedule, employment, area_name, professional_roles_name, published_at)
+SELECT vacancies_id,
+       (data_jsonb -> 'salary' ->> 'from')::int,
+       (data_jsonb -> 'salary' ->> 'to')::int,
+       data_jsonb -> 'salary' ->> 'currency',
+       (data_jsonb -> 'salary' ->> 'gross')::bool,
+       data_jsonb -> 'experience' ->> 'name',
+       data_jsonb -> 'schedule' ->> 'name',
+       data_jsonb -> 'employment' ->> 'name',
+       data_jsonb -> 'area' ->> 'name',
+       data_jsonb -> 'professional_roles' -> 0 ->> 'name',
+       (data_jsonb ->> 'published_at')::timestamptz
+FROM vacancies WHERE %(ids)s::int[] IS NULL OR vacancies_id = ANY(%(ids)s)
+ON CONFLICT (vacancies_id) DO UPDATE SET
+    salary_from = EXCLUDED.salary_from,
+    salary_to = EXCLUDED.salary_to,
+    salary_currency = EXCLUDED.salary_currency,
+    salary_gross = EXCLUDED.salary_gross,
+    experience = EXCLUDED.experience,
+    schedule = EXCLUDED.schedule,
+    employment = EXCLUDED.employment,
+    area_name = EXCLUDED.area_name,
+    professional_roles_name = EXCLUDED.professional_roles_name,
+    published_at = EXCLUDED.published_at;
+
+DELETE FROM vacancy_skills WHERE %(ids)s::int[] IS NULL OR vacancies_id = ANY(%(ids)s);
+INSERT INTO vacancy_skills (vacancies_id, name)
+SELECT vacancies_id, skill ->> 'name'
+FROM vacancies, jsonb_array_elements(coalesce(data_jsonb -> 'key_skills', '[]')) AS skill
+WHERE (%(ids)s::int[] IS NULL OR vacancies_id = ANY(%(ids)s)) AND skill ->> 'name' IS NOT NULL
+ON CONFLICT DO NOTHING;
+
+DELETE FROM vacancy_metro WHERE %(ids)s::int[] IS NULL OR vacancies_id = ANY(%(ids)s);
+INSERT INTO vacancy_metro (vacancies_id, station_name)
+SELECT vacancies_id, station ->> 'station_name'
+FROM vacancies, jsonb_array_elements(coalesce(data_jsonb -> 'address' -> 'metro_stations', '[]')) AS station
+WHERE (%(ids)s::int[] IS NULL OR vacancies_id = ANY(%(ids)s)) AND station ->> 'station_name' IS NOT NULL
+ON CONFLICT DO NOTHING;
+'''
+
+CREATE_STATE_QUERY = '''
+CREATE TABLE IF NOT EXISTS crawl_state (
+    name TEXT PRIMARY KEY,
+    date_to TIMESTAMP NOT NULL
+);
+'''
+
+# Отметка только растёт: инкрементальный запуск по более старому интервалу
+# не должен отодвигать её назад
+SET_MARK_QUERY = '''
+INSERT INTO crawl_state (name, date_to) VALUES (%s, %s)
+ON CONFLICT (name) DO UPDATE SET date_to = GREATEST(crawl_state.date_to, EXCLUDED.date_to)
+'''
+
+UP_TO_DATE_QUERY = '''
+SELECT c.id FROM unnest(%s::int[], %s::timestamptz[]) AS c(id, published_at)
+JOIN vacancies v ON v.vacancies_id = c.id
+WHERE (v.data_jsonb ->> 'published_at')::timestamptz >= c.published_at
+'''
+
+
+def connect():
+    return psycopg2.connect(**DB_PARAMS)
+
+
+def ensure_schema(cur):
+    # Таблица вакансий, row_version и проекция vacancy_facts; проекция
+    # заполняется, если её ещё не было (база от прежней версии)
+    cur.execute(CREATE_TABLE_QUERY)
+    cur.execute(ADD_ROW_VERSION_QUERY)
+    cur.execute("SELECT to_regclass('vacancy_facts')")
+    missing = cur.fetchone()[0] is None
+    cur.execute(CREATE_PROJECTION_QUERY)
+    if missing:
+        logger.info('Заполняю проекцию vacancy_facts по сохранённым вакансиям')
+        cur.execute(PROJECT_QUERY, {'ids': None})
+
+
+class Writer:
+    # Пакетная запись вакансий через одно долгоживущее соединение:
+    # одна транзакция на пакет - COPY в staging и INSERT ... ON CONFLICT
+    def __init__(self, upsert=False):
+        self.upsert = upsert
+        self.conn = None
+
+    def open(self):
+        if self.conn is None or self.conn.closed:
+            self.conn = connect()
+            with self.conn:
+                with self.conn.cursor() as cur:
+                    ensure_schema(cur)
+                    cur.execute(CREATE_STAGING_QUERY)
+        return self.conn
+
+    def write(self, rows):
+        # rows - пары (vacancies_id, json в байтах); повторы внутри пакета
+        # ON CONFLICT DO UPDATE не допускает, поэтому остаётся последняя версия
+        rows = dict(rows)
+        if not rows:
+            return 0
+        conn = self.open()
+        query = UPSERT_QUERY if self.upsert else INSERT_QUERY
+        with metrics.span('db_batch_write_seconds'), conn:
+            with conn.cursor() as cur:
+                cur.copy_expert(COPY_QUERY, io.BytesIO(self.to_csv(rows)))
+                cur.execute(query)
+                changed = [row[0] for row in cur.fetchall()]
+                if changed:
+                    cur.execute(PROJECT_QUERY, {'ids': changed})
+        metrics.inc('db_rows_written_total', len(changed))
+        return len(changed)
+
+    def to_csv(self, rows):
+        lines = []
+        for vacancies_id, data in rows.items():
+            if isinstance(data, str):
+                data = data.encode()
+            lines.append(b'%d,"%s"\n' % (int(vacancies_id), data.replace(b'"', b'""')))
+        return b''.join(lines)
+
+    def close(self):
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            except Exception as err:
+                logger.warning(f'Не удалось закрыть соединение с базой: {err}')
+            self.conn = None
+
+
+class State:
+    # Отметка последнего обработанного date_to и проверка уже сохранённых
+    # вакансий. Соединение отдельное от Writer: к нему обращаются потоки
+    # пейджеров, пока Writer пишет пакет в своей транзакции
+    def __init__(self):
+        self.conn = None
+        self.lock = threading.Lock()
+
+    def open(self):
+        if self.conn is None or self.conn.closed:
+            self.conn = connect()
+            with self.conn:
+                with self.conn.cursor() as cur:
+                    cur.execute(CREATE_TABLE_QUERY)
+                    cur.execute(ADD_ROW_VERSION_QUERY)
+                    cur.execute(CREATE_STATE_QUERY)
+        return self.conn
+
+    def get_mark(self, name):
+        with self.lock:
+            conn = self.open()
+            with conn:
+                with conn.cursor() as cur:
+                    cur.execute('SELECT date_to FROM crawl_state WHERE name = %s', (name,))
+                    row = cur.fetchone()
+        return row[0] if row else None
+
+    def set_mark(self, name, date_to):
+        with self.lock:
+            conn = self.open()
+            with conn:
+                with conn.cursor() as cur:
+                    cur.execute(SET_MARK_QUERY, (name, date_to))
+
+    def up_to_date(self, items):
+        # items - элементы выдачи поиска; возвращает id тех, что уже лежат
+        # в базе с published_at не старше, чем в выдаче
+        ids = [int(i['id']) for i in items]
+        published = [i.get('published_at') for i in items]
+        with self.lock:
+            conn = self.open()
+            with conn:
+                with conn.cursor() as cur:
+                    cur.execute(UP_TO_DATE_QUERY, (ids, published))
+                    return {str(row[0]) for row in cur.fetchall()}
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None:
+                try:
+                    self.conn.close()
+                except Exception as err:
+                    logger.warning(f'Не удалось закрыть соединение с базой: {err}')
+                self.conn = None
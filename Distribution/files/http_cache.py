@@ -0,0 +1,110 @@
+import sqlite3
+import threading
+import time
+from urllib.parse import urlencode
+
+CACHE_PATH = 'cache/http.sqlite3'
+DEFAULT_SEARCH_TTL = 60 * 60
+DEFAULT_DETAIL_TTL = 24 * 60 * 60
+DEFAULT_MAX_BYTES = 1024 ** 3
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    body BLOB NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    stored_at REAL NOT NULL,
+    used_at REAL NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_used_at_idx ON responses (used_at);
+'''
+
+
+class CacheMiss(Exception):
+    pass
+
+
+class Entry:
+    def __init__(self, body, etag, last_modified, stored_at):
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+        self.stored_at = stored_at
+
+    def is_fresh(self, ttl):
+        return time.time() - self.stored_at < ttl
+
+
+class ResponseCache:
+    # Дисковый кэш ответов API в SQLite. Устаревшие записи не удаляются сразу:
+    # их ETag/Last-Modified используются для условного запроса. Когда объём
+    # превышает max_bytes, вытесняются давно не использованные ответы
+    def __init__(self, path=CACHE_PATH, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript(SCHEMA)
+        self.total = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    @staticmethod
+    def key(url, params=None):
+        if not params:
+            return url
+        return f'{url}?{urlencode(sorted(params.items()), doseq=True)}'
+
+    def get(self, key):
+        with self.lock:
+            row = self.conn.execute('SELECT body, etag, last_modified, stored_at FROM responses WHERE key = ?',
+                                    (key,)).fetchone()
+            if row is None:
+                return None
+            self.conn.execute('UPDATE responses SET used_at = ? WHERE key = ?', (time.time(), key))
+            self.conn.commit()
+        return Entry(*row)
+
+    def put(self, key, body, etag=None, last_modified=None):
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute('SELECT size FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is not None:
+                self.total -= row[0]
+            self.conn.execute('INSERT OR REPLACE INTO responses (key, body, etag, last_modified, stored_at, used_at, '
+                              'size) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                              (key, body, etag, last_modified, now, now, len(body)))
+            self.total += len(body)
+            if self.total > self.max_bytes:
+                self.evict()
+            self.conn.commit()
+
+    def touch(self, key):
+        # Ответ 304: сохранённая копия снова считается свежей
+        with self.lock:
+            now = time.time()
+            self.conn.execute('UPDATE responses SET stored_at = ?, used_at = ? WHERE key = ?', (now, now, key))
+            self.conn.commit()
+
+    def delete(self, key):
+        with self.lock:
+            row = self.conn.execute('SELECT size FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return
+            self.conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+            self.total -= row[0]
+            self.conn.commit()
+
+    def evict(self):
+        # Освобождается с запасом, до 90% лимита, чтобы не чистить на каждой записи
+        target = self.max_bytes * 0.9
+        rows = self.conn.execute('SELECT key, size FROM responses ORDER BY used_at').fetchall()
+        for key, size in rows:
+            if self.total <= target:
+                break
+            self.conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+            self.total -= size
+
+    def close(self):
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
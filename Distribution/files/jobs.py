@@ -0,0 +1,94 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from loguru import logger
+
+MAX_CONCURRENT_CRAWLS = 1
+# Завершённые задачи хранятся час, чтобы клиент успел забрать результат
+JOB_TTL = 60 * 60
+
+
+class Job:
+    def __init__(self, key, worker):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.worker = worker
+        self.status = 'queued'
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.progress = None
+
+    def release(self):
+        # Итоговый прогресс остаётся, а Worker с ids_set и сессией освобождается
+        self.progress = self.worker.progress()
+        self.worker = None
+
+    def to_dict(self):
+        worker = self.worker
+        progress = worker.progress() if worker is not None else dict(self.progress)
+        started_at = progress.pop('started_at')
+        elapsed = ((self.finished_at or time.time()) - started_at) if started_at else 0
+        rate = progress['requests_sent'] / elapsed if elapsed else 0
+        # Оценка по скорости записи: пока идёт планирование, общее число ids
+        # неизвестно и ETA не считается
+        eta = None
+        written_rate = progress['docs_written'] / elapsed if elapsed else 0
+        if self.status == 'running' and progress['phase'] != 'planning' and written_rate:
+            remaining = progress['ids_found'] - progress['ids_skipped'] - progress['docs_written']
+            eta = max(0, remaining) / written_rate
+        return dict(progress, id=self.id, status=self.status, error=self.error, elapsed=elapsed,
+                    request_rate=rate, eta=eta)
+
+
+class JobManager:
+    # Запускает Worker в фоне. Одновременно выполняется не больше
+    # max_workers парсингов, остальные ждут в очереди исполнителя; повторный
+    # запрос того же интервала возвращает уже идущую задачу
+    def __init__(self, max_workers=MAX_CONCURRENT_CRAWLS, on_finish=None):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.on_finish = on_finish
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def submit(self, key, make_worker):
+        # make_worker вызывается только для новой задачи: Worker сразу
+        # открывает HTTP-сессию, и для дубликата создавать его незачем
+        with self.lock:
+            self.expire()
+            for job in self.jobs.values():
+                if job.key == key and job.status in ('queued', 'running'):
+                    return job
+            job = Job(key, make_worker())
+            self.jobs[job.id] = job
+        self.executor.submit(self.run_job, job)
+        return job
+
+    def expire(self):
+        now = time.time()
+        for job_id in [job.id for job in self.jobs.values() if job.finished_at and now - job.finished_at > JOB_TTL]:
+            del self.jobs[job_id]
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def run_job(self, job):
+        job.status = 'running'
+        try:
+            job.worker.run()
+        except Exception as err:
+            logger.exception(f'Задача {job.id} завершилась с ошибкой')
+            job.status = 'failed'
+            job.error = str(err)
+        else:
+            job.status = 'done'
+        finally:
+            job.finished_at = time.time()
+        if self.on_finish is not None:
+            try:
+                self.on_finish(job)
+            except Exception:
+                logger.exception('Ошибка обработчика завершения задачи')
+        job.release()
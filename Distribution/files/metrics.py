@@ -0,0 +1,102 @@
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+# Счётчики и таймеры процесса в формате Prometheus (/metrics) и
+# включаемый вручную семплирующий профилировщик
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.timers = {}
+
+    @staticmethod
+    def key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        key = self.key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = self.key(name, labels)
+        with self.lock:
+            count, total, maximum = self.timers.get(key, (0, 0.0, 0.0))
+            self.timers[key] = (count + 1, total + seconds, max(maximum, seconds))
+
+    @contextmanager
+    def span(self, name, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    @staticmethod
+    def format(name, labels, value):
+        if labels:
+            name += '{' + ','.join(f'{k}="{v}"' for k, v in labels) + '}'
+        return f'{name} {value}'
+
+    def render(self):
+        with self.lock:
+            counters = sorted(self.counters.items())
+            timers = sorted(self.timers.items())
+        lines = []
+        for (name, labels), value in counters:
+            lines.append(self.format(name, labels, value))
+        for (name, labels), (count, total, maximum) in timers:
+            lines.append(self.format(f'{name}_count', labels, count))
+            lines.append(self.format(f'{name}_sum', labels, total))
+            lines.append(self.format(f'{name}_max', labels, maximum))
+        return '\n'.join(lines) + '\n'
+
+
+class Sampler:
+    # Раз в interval секунд снимает стеки всех потоков и считает одинаковые;
+    # результат - свёрнутые стеки (формат flamegraph.pl / speedscope)
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.stacks = Counter()
+        self.thread = None
+        self.running = threading.Event()
+
+    def start(self):
+        if self.running.is_set():
+            return
+        self.stacks = Counter()
+        self.running.set()
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running.clear()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        return '\n'.join(f'{stack} {count}' for stack, count in self.stacks.most_common()) + '\n'
+
+    def sample(self):
+        own = threading.get_ident()
+        while self.running.is_set():
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({code.co_filename}:{frame.f_lineno})')
+                    frame = frame.f_back
+                self.stacks[';'.join(reversed(stack))] += 1
+            time.sleep(self.interval)
+
+
+registry = Registry()
+inc = registry.inc
+observe = registry.observe
+span = registry.span
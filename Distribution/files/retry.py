@@ -0,0 +1,156 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+import requests
+from loguru import logger
+import metrics
+
+DEFAULT_ATTEMPTS = 6
+DEFAULT_BASE_DELAY = 1
+DEFAULT_MAX_DELAY = 60
+DEFAULT_DEADLINE = 120
+DEFAULT_FAILURE_THRESHOLD = 10
+DEFAULT_COOL_DOWN = 30
+PROBE_INTERVAL = 1
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class RetryError(Exception):
+    pass
+
+
+class CircuitOpen(RetryError):
+    pass
+
+
+def retry_after(err):
+    # Retry-After бывает числом секунд или HTTP-датой
+    response = getattr(err, 'response', None)
+    value = response.headers.get('Retry-After') if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable(err):
+    if isinstance(err, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    if isinstance(err, requests.exceptions.HTTPError) and err.response is not None:
+        return err.response.status_code in RETRY_STATUSES
+    return False
+
+
+def reason(err):
+    if isinstance(err, requests.exceptions.Timeout):
+        return 'timeout'
+    if isinstance(err, requests.exceptions.ConnectionError):
+        return 'connection'
+    return str(err.response.status_code)
+
+
+class CircuitBreaker:
+    # После threshold ошибок подряд запросы к endpoint приостанавливаются на
+    # cool_down секунд, затем пропускается один пробный запрос (half-open)
+    def __init__(self, name, threshold=DEFAULT_FAILURE_THRESHOLD, cool_down=DEFAULT_COOL_DOWN):
+        self.name = name
+        self.threshold = threshold
+        self.cool_down = cool_down
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def acquire(self, deadline):
+        # True - вызывающему достался пробный запрос half-open
+        while True:
+            with self.lock:
+                if self.opened_at is None:
+                    return False
+                wait = self.opened_at + self.cool_down - time.monotonic()
+                if wait <= 0 and not self.probing:
+                    self.probing = True
+                    return True
+            wait = max(wait, PROBE_INTERVAL)
+            if time.monotonic() + wait > deadline:
+                raise CircuitOpen(f'{self.name}: circuit breaker открыт')
+            metrics.inc('crawler_circuit_wait_seconds_total', wait, kind=self.name)
+            time.sleep(wait)
+
+    def success(self, probe=False):
+        with self.lock:
+            if self.opened_at is not None:
+                # Ответ на запрос, отправленный до открытия, о восстановлении
+                # не говорит: закрывает только пробный
+                if not probe:
+                    return
+                logger.info(f'{self.name}: circuit breaker закрыт')
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def failure(self, probe=False):
+        with self.lock:
+            self.failures += 1
+            if probe or (self.opened_at is None and self.failures >= self.threshold):
+                self.opened_at = time.monotonic()
+                self.probing = False
+                metrics.inc('crawler_circuit_open_total', kind=self.name)
+                logger.warning(f'{self.name}: circuit breaker открыт на {self.cool_down} с '
+                               f'после {self.failures} ошибок подряд')
+
+
+class Retrier:
+    # Повтор запроса с экспоненциальной задержкой и jitter в пределах
+    # deadline; у каждого endpoint свой circuit breaker
+    def __init__(self, name, attempts=DEFAULT_ATTEMPTS, base_delay=DEFAULT_BASE_DELAY, max_delay=DEFAULT_MAX_DELAY,
+                 deadline=DEFAULT_DEADLINE, breaker=None):
+        self.name = name
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.breaker = breaker if breaker != None else CircuitBreaker(name)
+
+    def delay(self, attempt, err):
+        # Full jitter: равномерно от 0 до экспоненциальной границы
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+        server_delay = retry_after(err)
+        if server_delay != None:
+            delay = server_delay + random.uniform(0, self.base_delay)
+        return delay
+
+    def call(self, func, *args, **kwargs):
+        deadline = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            probe = self.breaker.acquire(deadline)
+            try:
+                result = func(*args, **kwargs)
+            except Exception as err:
+                if not is_retryable(err):
+                    # Состояние меняет только проба: endpoint ответил, хоть и
+                    # не тем, что повторяют. Остальным (404, CacheMiss) не
+                    # доверяется закрыть breaker без half-open
+                    if probe:
+                        self.breaker.success(probe=True)
+                    raise
+                self.breaker.failure(probe)
+                attempt += 1
+                delay = self.delay(attempt, err)
+                if attempt >= self.attempts or time.monotonic() + delay > deadline:
+                    raise RetryError(f'{self.name}: {attempt} попыток без успеха, последняя ошибка: {err}') from err
+                metrics.inc('crawler_retries_total', kind=self.name, reason=reason(err))
+                metrics.inc('crawler_backoff_seconds_total', delay, kind=self.name)
+                time.sleep(delay)
+            else:
+                self.breaker.success(probe)
+                return result
@@ -0,0 +1,279 @@
+import argparse
+import contextlib
+import multiprocessing
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+from loguru import logger
+import db
+import work
+
+DEFAULT_ROLE_GROUP_SIZE = 4
+DEFAULT_SHARD_HOURS = 6
+DEFAULT_PROCESSES = 4
+DEFAULT_LEASE = 30 * 60
+DEFAULT_MAX_ATTEMPTS = 3
+SHARD_CHECKPOINT_DIR = 'cache/shards'
+
+# Очередь шардов: группа ролей x интервал времени. Шарды одного crawl не
+# пересекаются, а захват через FOR UPDATE SKIP LOCKED позволяет разбирать
+# очередь любому числу процессов и контейнеров с общей базой
+CREATE_SHARDS_QUERY = '''
+CREATE TABLE IF NOT EXISTS crawl_shards (
+    id SERIAL PRIMARY KEY,
+    crawl TEXT NOT NULL,
+    roles TEXT[] NOT NULL,
+    date_from TIMESTAMP NOT NULL,
+    date_to TIMESTAMP NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    owner TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    claimed_at TIMESTAMP,
+    finished_at TIMESTAMP,
+    docs_written INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    UNIQUE (crawl, roles, date_from)
+);
+CREATE INDEX IF NOT EXISTS crawl_shards_status_idx ON crawl_shards (status, crawl);
+'''
+
+INSERT_SHARD_QUERY = '''
+INSERT INTO crawl_shards (crawl, roles, date_from, date_to) VALUES (%s, %s, %s, %s)
+ON CONFLICT (crawl, roles, date_from) DO NOTHING
+'''
+
+# Шард, чей владелец не продлевал аренду дольше lease секунд, считается
+# брошенным (процесс или контейнер упал) и снова доступен для захвата
+CLAIM_QUERY = '''
+UPDATE crawl_shards
+SET status = 'running', owner = %(owner)s, claimed_at = now(), attempts = attempts + 1
+WHERE id = (
+    SELECT id FROM crawl_shards
+    WHERE (%(crawl)s IS NULL OR crawl = %(crawl)s)
+      AND (status = 'pending' OR (status = 'running' AND claimed_at < now() - %(lease)s * interval '1 second'))
+    ORDER BY date_to DESC, id
+    LIMIT 1
+    FOR UPDATE SKIP LOCKED
+)
+RETURNING id, crawl, roles, date_from, date_to
+'''
+
+FAIL_QUERY = '''
+UPDATE crawl_shards
+SET status = CASE WHEN attempts >= %(max_attempts)s THEN 'failed' ELSE 'pending' END, owner = NULL, error = %(error)s
+WHERE id = %(id)s AND owner = %(owner)s
+'''
+
+
+def split_roles(roles, size):
+    return [roles[i:i + size] for i in range(0, len(roles), size)]
+
+
+def split_range(date_last, date_to, hours):
+    ranges = []
+    date_from = date_last
+    while date_from < date_to:
+        date_right = min(date_from + timedelta(hours=hours), date_to)
+        ranges.append((date_from, date_right))
+        date_from = date_right
+    return ranges
+
+
+class Coordinator:
+    def __init__(self, lease=DEFAULT_LEASE, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.conn = None
+        self.lock = threading.Lock()
+
+    def open(self):
+        if self.conn is None or self.conn.closed:
+            self.conn = db.connect()
+            with self.conn:
+                with self.conn.cursor() as cur:
+                    cur.execute(CREATE_SHARDS_QUERY)
+        return self.conn
+
+    def execute(self, query, params=None):
+        with self.lock:
+            conn = self.open()
+            with conn:
+                with conn.cursor() as cur:
+                    cur.execute(query, params)
+                    return cur.fetchall() if cur.description else cur.rowcount
+
+    def plan(self, crawl, date_last, date_to, roles=work.ID_ROLES_LIST, group_size=DEFAULT_ROLE_GROUP_SIZE,
+             hours=DEFAULT_SHARD_HOURS):
+        shards = [(crawl, group, date_from, date_right) for group in split_roles(list(roles), group_size)
+                  for date_from, date_right in split_range(date_last, date_to, hours)]
+        with self.lock:
+            conn = self.open()
+            with conn:
+                with conn.cursor() as cur:
+                    cur.executemany(INSERT_SHARD_QUERY, shards)
+        logger.info(f'Crawl {crawl}: запланировано шардов {len(shards)}')
+        return len(shards)
+
+    def claim(self, owner, crawl=None):
+        rows = self.execute(CLAIM_QUERY, {'owner': owner, 'crawl': crawl, 'lease': self.lease})
+        return rows[0] if rows else None
+
+    def heartbeat(self, shard_id, owner):
+        # False - шард уже перехвачен другим процессом
+        return self.execute("UPDATE crawl_shards SET claimed_at = now() WHERE id = %s AND owner = %s "
+                            "AND status = 'running'", (shard_id, owner)) > 0
+
+    def finish(self, shard_id, owner, docs_written):
+        self.execute("UPDATE crawl_shards SET status = 'done', finished_at = now(), docs_written = %s, error = NULL "
+                     "WHERE id = %s AND owner = %s", (docs_written, shard_id, owner))
+
+    def fail(self, shard_id, owner, error):
+        self.execute(FAIL_QUERY, {'id': shard_id, 'owner': owner, 'error': error, 'max_attempts': self.max_attempts})
+
+    def status(self, crawl=None):
+        rows = self.execute('SELECT crawl, status, count(*), sum(docs_written) FROM crawl_shards '
+                            'WHERE %(crawl)s IS NULL OR crawl = %(crawl)s GROUP BY crawl, status ORDER BY crawl, status',
+                            {'crawl': crawl})
+        return [{'crawl': row[0], 'status': row[1], 'shards': row[2], 'docs_written': row[3]} for row in rows]
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+
+def crawl_shard(coordinator, shard, owner, **worker_kwargs):
+    shard_id, crawl, roles, date_from, date_to = shard
+    logger.info(f'{owner}: шард {shard_id} ({crawl}), роли {",".join(roles)}, {date_from} - {date_to}')
+    # У каждого шарда свой файл чекпоинта: SQLite плохо переносит запись из
+    # нескольких процессов, а упавший шард продолжит любой процесс на этом хосте
+    checkpoint_path = os.path.join(SHARD_CHECKPOINT_DIR, f'{shard_id}.sqlite3')
+    worker = work.Worker(date_from, date_to, roles=roles, checkpoint_path=checkpoint_path, **worker_kwargs)
+    stopped = threading.Event()
+
+    def keep_lease():
+        # Если аренду не удаётся продлить, Worker останавливается раньше, чем
+        # она истечёт и шард достанется другому процессу
+        renewed = time.monotonic()
+        while not stopped.wait(coordinator.lease / 6):
+            try:
+                if not coordinator.heartbeat(shard_id, owner):
+                    logger.error(f'{owner}: шард {shard_id} перехвачен другим процессом, останавливаю')
+                    worker.cancel()
+                    return
+                renewed = time.monotonic()
+            except Exception as err:
+                logger.warning(f'{owner}: не удалось продлить аренду шарда {shard_id}: {err}')
+                coordinator.close()
+                if time.monotonic() - renewed > coordinator.lease / 2:
+                    logger.error(f'{owner}: аренда шарда {shard_id} не продлевается, останавливаю')
+                    worker.cancel()
+                    return
+
+    heartbeat = threading.Thread(target=keep_lease, daemon=True)
+    heartbeat.start()
+    # Аренда перестаёт продлеваться до отметки результата, иначе heartbeat
+    # принял бы завершённый шард за перехваченный
+    try:
+        worker.run()
+    except Exception as err:
+        logger.exception(f'{owner}: шард {shard_id} завершился с ошибкой')
+        error = str(err)
+    else:
+        error = f'потери: {worker.lost}' if worker.lost else None
+    finally:
+        stopped.set()
+        heartbeat.join()
+    if error != None:
+        # Чекпоинт шарда остаётся, повторная попытка докачает только недостающее
+        coordinator.fail(shard_id, owner, error)
+    else:
+        coordinator.finish(shard_id, owner, worker.docs_written)
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(checkpoint_path)
+
+
+def work_loop(crawl=None, rate=work.DEFAULT_RATE, lease=DEFAULT_LEASE, **worker_kwargs):
+    # Точка входа процесса: берёт шарды, пока они есть. rate - бюджет
+    # запросов в секунду этого процесса
+    owner = f'{socket.gethostname()}:{os.getpid()}'
+    work.Worker.limiter = work.RateLimiter(rate, max(1, int(rate)))
+    os.makedirs(SHARD_CHECKPOINT_DIR, exist_ok=True)
+    coordinator = Coordinator(lease=lease)
+    done = 0
+    try:
+        while True:
+            shard = coordinator.claim(owner, crawl)
+            if shard is None:
+                break
+            crawl_shard(coordinator, shard, owner, **worker_kwargs)
+            done += 1
+    finally:
+        coordinator.close()
+    logger.info(f'{owner}: очередь пуста, обработано шардов {done}')
+    return done
+
+
+def run(crawl=None, processes=DEFAULT_PROCESSES, rate=None, **worker_kwargs):
+    # rate - лимит запросов в секунду на весь пул этого контейнера, делится
+    # между процессами; по умолчанию каждому процессу DEFAULT_RATE, и больше
+    # процессов - быстрее обход. Другие контейнеры лимит не делят
+    if rate == None:
+        rate = work.DEFAULT_RATE * processes
+    kwargs = dict(worker_kwargs, crawl=crawl, rate=rate / processes)
+    with multiprocessing.Pool(processes) as pool:
+        results = [pool.apply_async(work_loop, kwds=kwargs) for _ in range(processes)]
+        return sum(result.get() for result in results)
+
+
+def parse_date(value):
+    return datetime.fromisoformat(value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Шардированный парсинг вакансий через общую очередь в Postgres')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    plan = commands.add_parser('plan', help='разбить интервал на шарды')
+    plan.add_argument('--crawl', required=True)
+    plan.add_argument('--from', dest='date_from', type=parse_date, required=True)
+    plan.add_argument('--to', dest='date_to', type=parse_date, default=datetime.now().replace(microsecond=0))
+    plan.add_argument('--group-size', type=int, default=DEFAULT_ROLE_GROUP_SIZE)
+    plan.add_argument('--hours', type=float, default=DEFAULT_SHARD_HOURS)
+
+    worker = commands.add_parser('work', help='разбирать очередь шардов')
+    worker.add_argument('--crawl', default=None)
+    worker.add_argument('--processes', type=int, default=DEFAULT_PROCESSES)
+    worker.add_argument('--threads', type=int, default=work.DEFAULT_WORKERS)
+    worker.add_argument('--rate', type=float, default=None,
+                        help=f'запросов в секунду на контейнер, делится между процессами '
+                             f'(по умолчанию {work.DEFAULT_RATE} на процесс)')
+    worker.add_argument('--lease', type=int, default=DEFAULT_LEASE)
+    worker.add_argument('--slim', action='store_true')
+    worker.add_argument('--upsert', action='store_true')
+
+    status = commands.add_parser('status', help='состояние шардов')
+    status.add_argument('--crawl', default=None)
+
+    args = parser.parse_args()
+    if args.command == 'plan':
+        coordinator = Coordinator()
+        coordinator.plan(args.crawl, args.date_from, args.date_to, group_size=args.group_size, hours=args.hours)
+        coordinator.close()
+    elif args.command == 'work':
+        # HTTP-кэш в SQLite не рассчитан на запись из многих процессов
+        done = run(args.crawl, args.processes, args.rate, lease=args.lease, workers=args.threads, slim=args.slim,
+                   upsert=args.upsert, cache_path=None)
+        logger.info(f'Обработано шардов: {done}')
+    else:
+        coordinator = Coordinator()
+        for row in coordinator.status(args.crawl):
+            print(f"{row['crawl']}\t{row['status']}\t{row['shards']}\t{row['docs_written'] or 0}")
+        coordinator.close()
+
+
+if __name__ == '__main__':
+    main()
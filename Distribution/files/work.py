@@ -1,12 +1,23 @@
 import json
+import os
 import requests
 import time
+import threading
 from datetime import datetime, timedelta
 from loguru import logger
 import queue
-import psycopg2
-from psycopg2 import IntegrityError
+from requests.adapters import HTTPAdapter
 from fake_useragent import UserAgent
+import db
+import checkpoint
+import http_cache
+import metrics
+import retry
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 ID_ROLES_LIST = ['118', '114', '164', '126', '112', '10', '25', '38', '171', '84', '104', '172', '96', '166', '125',
                  '170', '87', '116', '55', '86', '113', '107', '48', '160', '1', '165', '12', '121', '36', '69', '124',
@@ -14,88 +25,279 @@ ID_ROLES_LIST = ['118', '114', '164', '126', '112', '10', '25', '38', '171', '84
                  '128', '53', '148', '135']
 
 DEFAULT_MAX_REC_RETURNED = 2000
-URL = 'https://api.hh.ru/vacancies'
+URL = os.environ.get('HH_API_URL', 'https://api.hh.ru/vacancies')
 DEFAULT_MAX_STEP_SIZE = 60 * 30
-DEFAULT_MIN_STEP_SIZE = 300
+DEFAULT_FILL_RATIO = 0.9
+DEFAULT_MAX_GROWTH = 4
+DEFAULT_WORKERS = 8
+DEFAULT_RATE = 10
+DEFAULT_BURST = 10
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_PAGERS = 2
+DEFAULT_QUEUE_SIZE = 1000
+DEFAULT_FLUSH_INTERVAL = 2
+DEFAULT_EMPTY_PAGE_RETRIES = 3
+CRAWL_MARK = 'vacancies'
+# Поля вакансии, которые используют аналитика и проекция vacancy_facts;
+# в режиме slim остальное (описание, контакты и т.п.) не сохраняется
+ANALYTICS_FIELDS = ['id', 'name', 'area', 'salary', 'experience', 'schedule', 'employment', 'professional_roles',
+                    'key_skills', 'address', 'employer', 'languages', 'type', 'created_at', 'published_at']
+STOP = object()
+
+
+def json_loads(data):
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+def json_dumps(obj):
+    return orjson.dumps(obj) if orjson is not None else json.dumps(obj, ensure_ascii=False).encode()
+
+
+class RateLimiter:
+    # Token bucket: rate - запросов в секунду, burst - размер всплеска
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.timestamp = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.timestamp) * self.rate)
+                self.timestamp = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            metrics.inc('crawler_ratelimit_wait_seconds_total', wait)
+            time.sleep(wait)
 
 
 class Worker:
-    queue_a = queue.Queue()
-    queue_b = queue.Queue()
     ua = UserAgent()
+    limiter = RateLimiter(DEFAULT_RATE, DEFAULT_BURST)
 
-    def __init__(self, date_last, date_to):
+    def __init__(self, date_last, date_to, workers=DEFAULT_WORKERS, pagers=DEFAULT_PAGERS, upsert=False,
+                 incremental=False, checkpoint_path=checkpoint.CHECKPOINT_PATH, slim=False,
+                 cache_path=http_cache.CACHE_PATH, offline=False, roles=ID_ROLES_LIST):
         self.date_last = date_last
         self.date_to = date_to
+        self.workers = workers
+        self.pagers = pagers
+        # Профессиональные роли в запросах поиска; шард обходит только свою группу
+        self.roles = list(roles)
+        self.incremental = incremental
+        self.slim = slim
+        # offline - воспроизведение только из кэша, без обращений к API
+        self.offline = offline
+        self.cache_path = cache_path
+        self.cache = None
+        # В инкрементальном режиме повторно скачиваются только обновлённые
+        # вакансии, и их новая версия должна заменить старую
+        self.writer = db.Writer(upsert=upsert or incremental)
+        # Если новая версия должна заменить старую, карточка из кэша не годится
+        # без проверки: ttl 0 - всегда условный запрос с ETag
+        self.detail_ttl = 0 if upsert or incremental else http_cache.DEFAULT_DETAIL_TTL
+        self.state = db.State()
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint = None
+        # Очереди между стадиями: окна -> ids -> документы. Ограниченный размер
+        # не даёт быстрой стадии уйти вперёд и держит память постоянной
+        self.queue_a = queue.Queue(maxsize=DEFAULT_QUEUE_SIZE)
+        self.queue_ids = queue.Queue(maxsize=DEFAULT_QUEUE_SIZE)
+        self.queue_b = queue.Queue(maxsize=DEFAULT_QUEUE_SIZE)
         self.ids_set = set()
-        self.count = 0
-        self.count_errors = 0
+        self.ids_lock = threading.Lock()
+        self.ids_skipped = 0
+        self.phase = 'queued'
+        self.phase_started = None
+        self.started_at = None
+        self.stats_lock = threading.Lock()
+        self.requests_sent = 0
+        self.cache_hits = 0
+        self.pages_fetched = 0
+        self.pages_failed = 0
+        self.lost = {}
+        self.cancelled = threading.Event()
+        self.docs_written = 0
+        self.docs_failed = 0
+        self.windows_planned = 0
+        self.plan_requests = 0
+        # Свои повторы и circuit breaker для поиска и для карточек вакансий,
+        # чтобы сбои одного endpoint не тормозили другой
+        self.search_retry = retry.Retrier('search')
+        self.detail_retry = retry.Retrier('detail')
+        self.dead_ids = []
         self.headers = {"User-Agent": self.ua.random}
+        self.session = self.make_session()
+
+    def add_stat(self, name, value=1):
+        with self.stats_lock:
+            setattr(self, name, getattr(self, name) + value)
+
+    def progress(self):
+        with self.stats_lock:
+            return {
+                'phase': self.phase,
+                'started_at': self.started_at,
+                'windows_planned': self.windows_planned,
+                'plan_requests': self.plan_requests,
+                'pages_fetched': self.pages_fetched,
+                'ids_found': len(self.ids_set),
+                'ids_skipped': self.ids_skipped,
+                'docs_written': self.docs_written,
+                'docs_failed': self.docs_failed,
+                'requests_sent': self.requests_sent,
+                'cache_hits': self.cache_hits,
+                'dead_letters': len(self.dead_ids),
+            }
+
+    def set_phase(self, phase):
+        now = time.perf_counter()
+        if self.phase_started != None:
+            metrics.observe('crawler_phase_seconds', now - self.phase_started, phase=self.phase)
+        self.phase = phase
+        self.phase_started = now
+
+    def make_session(self):
+        session = requests.Session()
+        # Соединения одновременно держат fetchers, пейджеры и поток планировщика
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.workers + self.pagers + 1)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.headers.update(self.headers)
+        return session
+
+    def fetch(self, url, params=None, ttl=http_cache.DEFAULT_DETAIL_TTL):
+        kind = 'search' if params else 'detail'
+        key = http_cache.ResponseCache.key(url, params)
+        entry = self.cache.get(key) if self.cache != None else None
+        if entry != None and (self.offline or entry.is_fresh(ttl)):
+            self.add_stat('cache_hits')
+            metrics.inc('crawler_cache_hits_total', kind=kind)
+            return entry.body
+        if self.offline:
+            raise http_cache.CacheMiss(key)
+
+        headers = {}
+        if entry != None and entry.etag:
+            headers['If-None-Match'] = entry.etag
+        if entry != None and entry.last_modified:
+            headers['If-Modified-Since'] = entry.last_modified
+        self.limiter.acquire()
+        self.add_stat('requests_sent')
+        metrics.inc('crawler_requests_total', kind=kind)
+        try:
+            with metrics.span('crawler_request_seconds', kind=kind):
+                req = self.session.get(url, params=params, headers=headers, timeout=5)
+        except requests.exceptions.Timeout:
+            metrics.inc('crawler_timeouts_total', kind=kind)
+            raise
+        metrics.inc('crawler_responses_total', kind=kind, status=f'{req.status_code // 100}xx')
+        try:
+            if req.status_code == 304 and entry != None:
+                self.cache.touch(key)
+                self.add_stat('cache_hits')
+                metrics.inc('crawler_cache_hits_total', kind=kind)
+                return entry.body
+            req.raise_for_status()
+            content = req.content
+            if self.cache != None:
+                self.cache.put(key, content, req.headers.get('ETag'), req.headers.get('Last-Modified'))
+            return content
+        finally:
+            req.close()
 
-    def api_req(self, page, date_from, date_to, retry=2):
+    def api_req(self, page, date_from, date_to):
         params = {
             'per_page': 100,
             'page': page,
-            'professional_role': ID_ROLES_LIST,
+            'professional_role': self.roles,
             'date_from': f'{date_from.isoformat()}',
             'date_to': f'{date_to.isoformat()}'}
-        req = None
-        try:
-            req = requests.get(URL, params, headers=self.headers, timeout=5)
-            req.raise_for_status()
-
-        except requests.exceptions.ConnectionError as e:
-            self.count_errors += 1
-            if self.count_errors > 5:
-                self.count_errors = 0
+        # API изредка отдаёт пустую страницу при ненулевом found
+        for _ in range(DEFAULT_EMPTY_PAGE_RETRIES):
+            try:
+                content = self.search_retry.call(self.fetch, URL, params, ttl=http_cache.DEFAULT_SEARCH_TTL)
+            except http_cache.CacheMiss:
                 return None
-            time.sleep(15)
-
-            return self.api_req(page, date_from, date_to)
-        except Exception as err:
-            self.count_errors += 1
-            if self.count_errors > 5:
-                self.count_errors = 0
+            except Exception as err:
+                logger.error(f'Не удалось получить страницу {page} за {date_from} - {date_to}: {err}')
                 return None
-            time.sleep(4)
-            if retry:
-
-                return self.api_req(page, date_from, date_to, retry=(retry - 1))
-            else:
-                return self.api_req(page, date_from, date_to)
-        else:
-            self.count_errors = 0
-            self.count += 1
-            data = req.content.decode()
-            data = json.loads(data)
-            if retry:
-                if data['items'] == []:
-                    data = self.api_req(page, date_from, date_to, retry=(retry - 1))
-            else:
+            data = json_loads(content)
+            if data['found'] == 0 or data['items'] != []:
+                return data
+            # Пустая страница при found > 0 - сбой выдачи, а не ответ: из кэша
+            # она убирается, иначе повтор получил бы её же без запроса
+            if self.offline:
                 return None
-            return data
-        finally:
-            if req != None:
-                req.close()
-                if self.count >= 10:
-                    time.sleep(1)
-                    self.count = 0
+            if self.cache != None:
+                self.cache.delete(http_cache.ResponseCache.key(URL, params))
+        return None
 
     def get_time_step(self, date_left, date_right):
         if date_left < 0:
             date_left = 0
         data = self.api_req(0, self.convert_seconds_in_date(date_left), self.convert_seconds_in_date(date_right))
+        self.plan_requests += 1
+        width = date_right - date_left
         if data == None:
-            return date_left
-        if data['found'] < DEFAULT_MAX_REC_RETURNED:
-            self.queue_a.put(
-                [self.convert_seconds_in_date(date_left), self.convert_seconds_in_date(date_right)])
+            logger.warning(f'Не удалось прощупать окно {self.convert_seconds_in_date(date_left)} - '
+                           f'{self.convert_seconds_in_date(date_right)}, оно будет спланировано повторно')
+            self.checkpoint.add_gap(date_left, date_right)
+            return date_left, DEFAULT_MAX_STEP_SIZE
+        if data['found'] >= DEFAULT_MAX_REC_RETURNED and width > 1:
+            return date_right, self.fit_step(width, data['found'])
+        if data['found'] >= DEFAULT_MAX_REC_RETURNED:
+            logger.warning(f'Окно {self.convert_seconds_in_date(date_left)} содержит {data["found"]} вакансий, '
+                           f'часть данных будет потеряна')
+        window = [self.convert_seconds_in_date(date_left), self.convert_seconds_in_date(date_right), data['pages'], 1]
+        self.checkpoint.add_window(*window[:3])
+        self.queue_a.put(window)
+        self.windows_planned += 1
+        self.add_ids_in_set(data)
+        return date_left, self.fit_step(width, data['found'])
+
+    def fit_step(self, width, found):
+        # Размер следующего окна подбирается по плотности текущего так,
+        # чтобы в него попало чуть меньше DEFAULT_MAX_REC_RETURNED вакансий
+        max_step = width * DEFAULT_MAX_GROWTH
+        if found == 0:
+            return max_step
+        step = width * DEFAULT_MAX_REC_RETURNED * DEFAULT_FILL_RATIO / found
+        return max(1, int(min(step, max_step)))
+
+    def plan_windows(self):
+        position = self.checkpoint.planner_position()
+        if position == None:
+            date_right, step, done = self.date_to, DEFAULT_MAX_STEP_SIZE, False
+        else:
+            date_right, step, done = position
+        if done:
+            logger.info('Планирование уже выполнено в прерванном запуске')
         else:
-            while date_right != date_left:
-                self.queue_a.put([self.convert_seconds_in_date(date_right - DEFAULT_MIN_STEP_SIZE),
-                                  self.convert_seconds_in_date(date_right)])
-                date_right -= DEFAULT_MIN_STEP_SIZE
-        return date_left
+            while date_right > 0:
+                if self.cancelled.is_set():
+                    return
+                date_right, step = self.get_time_step(date_right - step, date_right)
+                self.checkpoint.save_planner(date_right, step)
+            self.checkpoint.save_planner(date_right, step, done=True)
+        self.plan_gaps()
+        logger.info(f'Планирование завершено. Окон: {self.windows_planned}, запросов: {self.plan_requests}')
+
+    def plan_gaps(self):
+        # Один повторный проход по интервалам с неудачной пробой; то, что не
+        # удалось и теперь, остаётся в чекпоинте до следующего запуска
+        for date_left, date_right in self.checkpoint.gaps():
+            if self.cancelled.is_set():
+                return
+            self.checkpoint.remove_gap(date_left)
+            step = date_right - date_left
+            while date_right > date_left:
+                date_right, step = self.get_time_step(max(date_left, date_right - step), date_right)
 
     def convert_date_in_seconds(self, date):
         return (date - self.date_last).total_seconds()
@@ -104,107 +306,235 @@ class Worker:
         return self.date_last + timedelta(days=seconds / (24 * 60 * 60))
 
     def add_ids_in_set(self, data):
+        items = []
         for i in data['items']:
-            self.ids_set.add(i['id'])
+            with self.ids_lock:
+                if i['id'] in self.ids_set:
+                    continue
+                self.ids_set.add(i['id'])
+            items.append(i)
+        known = set()
+        if self.incremental and items:
+            try:
+                known = self.state.up_to_date(items)
+            except Exception as err:
+                logger.warning(f'Не удалось проверить сохранённые вакансии: {err}')
+                self.state.close()
+            with self.ids_lock:
+                self.ids_skipped += len(known)
+        new_ids = [i['id'] for i in items if i['id'] not in known]
+        self.checkpoint.add_ids(known, fetched=True)
+        self.checkpoint.add_ids(new_ids)
+        for id in new_ids:
+            self.queue_ids.put(id)
 
-    def make_req_ids(self, id, retry=2):
-        url = f'{URL}/{id}'
-        req = None
+    def make_req_ids(self, id):
         try:
-            req = requests.get(url, headers=self.headers, timeout=5)
-            req.raise_for_status()
-        except requests.exceptions.ConnectionError as e:
-            self.count_errors += 1
-            if self.count_errors > 5:
-                self.count_errors = 0
-                return None
-            time.sleep(15)
-            return self.make_req_ids(id)
+            return self.detail_retry.call(self.fetch, f'{URL}/{id}', ttl=self.detail_ttl)
+        except http_cache.CacheMiss:
+            return None
+        except retry.RetryError as err:
+            logger.warning(f'Вакансия {id} отложена до конца запуска: {err}')
+            with self.ids_lock:
+                self.dead_ids.append(id)
+            metrics.inc('crawler_dead_letters_total')
+            return None
         except Exception as err:
-            self.count_errors += 1
-            if self.count_errors > 5:
-                self.count_errors = 0
-                return None
+            logger.error(f'Не удалось получить вакансию {id}: {err}')
+            return None
 
-            time.sleep(self.count_errors * 2)
-            if retry:
-                time.sleep(10)
-                return self.make_req_ids(id, retry=(retry - 1))
-            else:
-                return self.make_req_ids(id)
-        else:
-            self.count_errors = 0
-            self.count += 1
-            data = req.content.decode()
-            return data
-        finally:
-            if req != None:
-                req.close()
-                if self.count % 10 == 0:
-                    time.sleep(1)
+    def retry_dead_letters(self):
+        # Один повторный проход по отложенным ids, когда основной поток
+        # уже скачан и breaker успел остыть
+        with self.ids_lock:
+            ids, self.dead_ids = self.dead_ids, []
+        if not ids or self.cancelled.is_set():
+            self.dead_ids.extend(ids)
+            return
+        logger.info(f'Повторяю отложенные вакансии: {len(ids)}')
+        fetchers = self.start_stage(self.fetch_details, self.workers)
+        for id in ids:
+            self.queue_ids.put(id)
+        self.stop_stage(fetchers, self.queue_ids)
+        if self.dead_ids:
+            logger.error(f'Не удалось скачать вакансий после повтора: {len(self.dead_ids)}')
 
-    def process_data_from_queue(self):
+    def process_data_from_queue(self, batch):
         try:
-            conn = psycopg2.connect(database='mydatabase', user='myuser', host='postgres', password='mypassword')
-            cur = conn.cursor()
+            written = self.writer.write(batch)
+        except Exception as err:
+            metrics.inc('db_batch_errors_total')
+            self.writer.close()
+            if len(batch) > 1:
+                # Пакет пишется одной транзакцией, и один испорченный документ
+                # откатывает все; половины пишутся отдельно, пока не останется
+                # только сама плохая строка
+                logger.warning(f'Не удалось записать пакет из {len(batch)} вакансий, делю пополам: {err}')
+                middle = len(batch) // 2
+                self.process_data_from_queue(batch[:middle])
+                self.process_data_from_queue(batch[middle:])
+                return
+            logger.error(f'Не удалось записать вакансию {batch[0][0]}: {err}')
+            self.add_stat('docs_failed')
+        else:
+            self.checkpoint.mark_fetched([id for id, _ in batch])
+            self.add_stat('docs_written', written)
+            logger.info(f'Закончил добавлять в базу: {written} из {len(batch)}')
+
+    def page_windows(self):
+        while True:
+            window = self.queue_a.get()
+            if window is STOP:
+                break
+            if self.cancelled.is_set():
+                continue
+            date_from, date_to, pages, first_page = window
+            for page in range(first_page, pages):
+                data = self.api_req(page, date_from, date_to)
+                if data == None:
+                    self.add_stat('pages_failed')
+                    break
+                self.add_ids_in_set(data)
+                self.add_stat('pages_fetched')
+                self.checkpoint.page_done(date_from, page)
+
+    def slim_document(self, data):
+        document = json_loads(data)
+        return json_dumps({key: document[key] for key in ANALYTICS_FIELDS if key in document})
+
+    def fetch_details(self):
+        while True:
+            id = self.queue_ids.get()
+            if id is STOP:
+                break
+            if self.cancelled.is_set():
+                continue
+            data = self.make_req_ids(id)
+            if data == None:
+                continue
+            if self.slim:
+                data = self.slim_document(data)
+            self.queue_b.put((id, data))
 
-            create_table_query = '''
-            CREATE TABLE IF NOT EXISTS vacancies (
-                vacancies_id INTEGER PRIMARY KEY,
-                data_jsonb JSONB
-            );
-            '''
+    def write_documents(self):
+        batch = []
+        deadline = time.monotonic() + DEFAULT_FLUSH_INTERVAL
+        while True:
+            try:
+                data = self.queue_b.get(timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                data = None
+            if data is STOP:
+                break
+            if data != None:
+                batch.append(data)
+            if len(batch) >= DEFAULT_BATCH_SIZE or time.monotonic() >= deadline:
+                if batch:
+                    self.process_data_from_queue(batch)
+                    batch = []
+                deadline = time.monotonic() + DEFAULT_FLUSH_INTERVAL
+        if batch:
+            self.process_data_from_queue(batch)
+        self.writer.close()
 
-            cur.execute(create_table_query)
-            conn.commit()
+    def start_stage(self, target, count=1):
+        threads = [threading.Thread(target=target, daemon=True) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        return threads
 
-            while not self.queue_b.empty():
-                data = self.queue_b.get()
+    def stop_stage(self, threads, stage_queue):
+        for _ in threads:
+            stage_queue.put(STOP)
+        for thread in threads:
+            thread.join()
 
-                vacancies_id = json.loads(data)['id']
+    def resume_from_mark(self):
+        mark = self.state.get_mark(CRAWL_MARK)
+        if mark != None and mark > self.date_last:
+            logger.info(f'Инкрементальный режим: продолжаю с {mark}')
+            self.date_last = min(mark, self.date_to)
 
-                sql = '''INSERT INTO vacancies (vacancies_id, data_jsonb) VALUES (%s, %s)'''
-                try:
-                    cur.execute(sql, (vacancies_id, str(data)))
-                    conn.commit()
-                except IntegrityError:
-                    conn.rollback()
+    def restore_checkpoint(self):
+        # Возвращает ids, которые прерванный запуск увидел, но не успел записать
+        pending_ids = []
+        for id, fetched in self.checkpoint.seen_ids():
+            self.ids_set.add(id)
+            if not fetched:
+                pending_ids.append(id)
+        if self.ids_set:
+            logger.info(f'Продолжаю прерванный запуск: ids {len(self.ids_set)}, не записано {len(pending_ids)}')
+        return pending_ids
 
-        except Exception as err:
-            print(err)
-        finally:
-            cur.close()
-            conn.close()
-            logger.info('Закончил добавлять в базу')
+    def cancel(self):
+        # Остановка без потери состояния: очереди дочитываются вхолостую,
+        # несделанное остаётся в чекпоинте
+        self.cancelled.set()
+
+    def losses(self):
+        # То, что запуск не смог сохранить: окна без пробы, недокачанные
+        # окна, отложенные ids и документы, которые отвергла база
+        losses = {'gaps': len(self.checkpoint.gaps()), 'pages_failed': self.pages_failed,
+                  'dead_letters': len(self.dead_ids), 'docs_failed': self.docs_failed,
+                  'cancelled': int(self.cancelled.is_set())}
+        return {name: count for name, count in losses.items() if count}
 
     def run(self):
+        self.started_at = time.time()
+        self.set_phase('planning')
+        date_to = self.date_to
+        if self.incremental:
+            self.resume_from_mark()
         logger.info(f'Запуск парсера. Временной интервал: От {self.date_to} --> до --> {self.date_last}')
+        key = f'{self.date_last.isoformat()}/{date_to.isoformat()}'
+        if self.roles != ID_ROLES_LIST:
+            key += '/' + ','.join(self.roles)
+        self.checkpoint = checkpoint.Checkpoint(key, self.checkpoint_path)
+        self.checkpoint.register(self.date_last, date_to, {'incremental': self.incremental,
+                                                           'upsert': self.writer.upsert, 'slim': self.slim})
+        pending_ids = self.restore_checkpoint()
+        if self.cache_path != None:
+            os.makedirs(os.path.dirname(self.cache_path) or '.', exist_ok=True)
+            self.cache = http_cache.ResponseCache(self.cache_path)
         self.date_to = self.convert_date_in_seconds(self.date_to)
-        while self.date_to != 0:
-            next_date = self.get_time_step(self.date_to - DEFAULT_MAX_STEP_SIZE, self.date_to)
-            self.date_to = next_date
 
-        logger.info('Процесс начал парсить ids')
-
-        while not self.queue_a.empty():
-            date_step = self.queue_a.get()
-            for page in range(20):
-                data = self.api_req(page, date_step[0], date_step[1])
-                if data == None:
-                    break
-                if (data['pages'] - page) <= 1:
-                    break
-                self.add_ids_in_set(data)
+        writer = self.start_stage(self.write_documents)
+        fetchers = self.start_stage(self.fetch_details, self.workers)
+        pagers = self.start_stage(self.page_windows, self.pagers)
 
+        for id in pending_ids:
+            self.queue_ids.put(id)
+        for window in self.checkpoint.pending_windows():
+            self.queue_a.put(window)
+        self.plan_windows()
+        self.set_phase('paging')
+        self.stop_stage(pagers, self.queue_a)
         logger.info('Процесс закончил парсить ids')
+        self.set_phase('details')
+        self.stop_stage(fetchers, self.queue_ids)
+        self.set_phase('retrying')
+        self.retry_dead_letters()
+        self.set_phase('writing')
+        self.stop_stage(writer, self.queue_b)
 
-        for id in self.ids_set:
-            data = self.make_req_ids(id)
-            if data == None:
-                continue
-            self.queue_b.put(data)
-            if self.count == 500:
-                self.process_data_from_queue()
-                self.count = 0
-        self.process_data_from_queue()
+        self.lost = self.losses()
+        if self.lost:
+            # Недостающие окна и ids остаются в чекпоинте, повторный запуск
+            # того же интервала докачает только их
+            logger.warning(f'Запуск завершён с потерями {self.lost}, чекпоинт сохранён')
+        else:
+            self.checkpoint.clear()
+        if self.incremental:
+            # С потерями отметка не двигается: следующий инкрементальный запуск
+            # пройдёт интервал заново, а сохранённое отсеет up_to_date
+            if not self.lost:
+                self.state.set_mark(CRAWL_MARK, date_to)
+            logger.info(f'Пропущено уже сохранённых вакансий: {self.ids_skipped}')
+        self.checkpoint.close()
+        if self.cache != None:
+            self.cache.close()
+        self.state.close()
+        self.session.close()
+        self.set_phase('done')
+        metrics.observe('crawler_run_seconds', time.time() - self.started_at)
         logger.info('Процесс закончил свою работу')